@@ -30,6 +30,14 @@ def read(file_or_stream):
     parameters.read(file_or_stream)
 
 
+def freeze_parameters():
+    return parameters.freeze()
+
+
+def install_parameters(frozen):
+    parameters.install(frozen)
+
+
 def input_file(template_string, **kw_replacements):
     filename = template_string.format(**kw_replacements)
     logger.info("Reading file {}".format(filename))
@@ -58,7 +66,7 @@ def output_database_table(template_string, **kw_replacements):
 
 
 # Working with argparse.ArgumentParser
-def add_arguments(parser):
+def add_arguments(parser, argv=None):
     """
     Adds arguments to an argparse.ArgumentParser from settings files.
 
@@ -73,12 +81,15 @@ def add_arguments(parser):
     order those appear.
 
     :param parser: This is an argparse.ArgumentParser.
+    :param argv: The arguments that will be parsed, such as sys.argv[1:].
+                 If given, only settings flags they name are added,
+                 unless they ask for help.
     :return:
     """
     parser.add_argument("--verbose", "-v", action="count")
     parser.add_argument("--quiet", "-q", action="count")
 
-    parameters.add_arguments(parser)
+    parameters.add_arguments(parser, argv)
 
 
 def namespace_settings(args):
@@ -157,13 +168,27 @@ def config_logging(args):
 
 
 # Loading settings
-def add_provenance(filename, additional=None):
+def add_provenance(filename, additional=None, store=None):
     """
-    This adds provenance information to a file.
-    :param filename:
-        This function opens this file and closes it. That's not good
-        to do if the file is being modified by another command.
+    This adds provenance information to a file, without touching the
+    file. It records the running script and process, and these
+    key-value pairs, in a sidecar store where they can be found
+    by the file's path or by the hash of its contents.
+
+    :param filename: The file, after it has been written.
     :param additional: A Mapping object (dict) of key-value pairs.
-    :return: None
+    :param store: A provda.sidecar.SidecarStore. Defaults to the one
+                  named by PROVDA_SIDECAR or in the provda cache.
+    :return: The SHA-256 of the file's contents.
     """
-    pass  # RFC 3339 for the dates.
+    # Imported here so that reading settings doesn't need git.
+    from . import collect, sidecar
+    if store is None:
+        store = sidecar.SidecarStore(sidecar.default_directory())
+    script_id, script = collect.this_script()
+    provenance = {"script_id": script_id}
+    provenance.update(script)
+    provenance.update(collect.this_process())
+    if additional is not None:
+        provenance.update(additional)
+    return store.put(filename, provenance)
@@ -0,0 +1,111 @@
+"""
+Ships provenance documents to a logstash json_lines input from an
+asyncio event loop. The records are the same as those from
+``provda.handler.send_tcp``, but connecting and sending never block
+the loop, so a collector can forward documents from many finished jobs
+at once.
+"""
+import asyncio
+import logging
+from .handler import json_lines
+
+
+logger = logging.getLogger("provda.asynchandler")
+
+
+class AsyncShipper(object):
+    """
+    Sends documents over their own connections, with at most
+    ``concurrency`` connections open. Each connection buffers at most
+    ``buffer_bytes`` that the peer hasn't accepted before the sender
+    waits for it to drain, and a peer that takes longer than ``timeout``
+    to accept a write fails only the document it was sending.
+    """
+    def __init__(self, host, port, concurrency=16, buffer_bytes=256 * 1024,
+                 batch_bytes=64 * 1024, timeout=30):
+        """
+        :param host: Hostname of logstash.
+        :param port: Port it is on.
+        :param concurrency: Most documents in flight at once.
+        :param buffer_bytes: Unsent bytes per connection before waiting.
+        :param batch_bytes: Size of each write to the connection.
+        :param timeout: Seconds to wait to connect or to drain a write.
+        """
+        self.host = host
+        self.port = port
+        self.buffer_bytes = buffer_bytes
+        self.batch_bytes = batch_bytes
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def ship(self, document):
+        """
+        Sends every record of one document.
+
+        :param document: A ProcessDocument, its ``as_dict()``,
+                         or its ``json()``.
+        :return: The number of records sent.
+        """
+        async with self._slots:
+            # Making the records settles the document, which collects
+            # git state, waits on digests, and encodes it, so it runs
+            # on a thread, not the loop.
+            lines = await asyncio.get_running_loop().run_in_executor(
+                None, list, json_lines(document))
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            writer.transport.set_write_buffer_limits(high=self.buffer_bytes)
+            total = 0
+            try:
+                batch = list()
+                size = 0
+                for line in lines:
+                    batch.append(line)
+                    size += len(line)
+                    total += 1
+                    if size >= self.batch_bytes:
+                        await self._write(writer, b"".join(batch))
+                        batch = list()
+                        size = 0
+                if batch:
+                    await self._write(writer, b"".join(batch))
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (ConnectionError, OSError) as err:
+                    logger.debug("Closing connection: {}".format(err))
+            logger.debug("sent {} objects".format(total))
+            return total
+
+    async def ship_many(self, documents):
+        """
+        Sends many documents concurrently. A failure sending one
+        document doesn't stop the others.
+
+        :param documents: An iterable of documents, as for ``ship``.
+        :return: A list with, for each document, the number of records
+                 sent or the exception that stopped it.
+        """
+        return await asyncio.gather(
+            *[self.ship(document) for document in documents],
+            return_exceptions=True)
+
+    async def _write(self, writer, data):
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), self.timeout)
+
+
+def ship_documents(documents, host, port, **kwargs):
+    """
+    Sends documents from code that isn't running an event loop.
+
+    :param documents: An iterable of documents, as for ``AsyncShipper.ship``.
+    :param host: Hostname of logstash.
+    :param port: Port it is on.
+    :param kwargs: Arguments for AsyncShipper.
+    :return: What ``AsyncShipper.ship_many`` returns.
+    """
+    async def run():
+        return await AsyncShipper(host, port, **kwargs).ship_many(documents)
+    return asyncio.run(run())
@@ -0,0 +1,379 @@
+"""
+A compact binary form of a provenance document, for shipping.
+
+PROV-JSON repeats the same qualified names, such as an activity's id
+in every relation, and the same attribute names on every record. This
+form writes each distinct string once, in a table, and refers to it
+by number. Records that have the same attribute names share a shape,
+so a relation is its id, a shape number, and the numbers of its
+values. Numbers are varints, so most take one byte. The result can
+be compressed with zlib.
+
+It encodes the PROV-JSON dictionary, so decoding gives back exactly
+the dictionary ``ProcessDocument.as_dict()`` made, and ``to_prov``
+makes the same ``prov.model.ProvDocument`` that the JSON would.
+
+Layout::
+
+    b"PVB" version flags | string lengths, strings | shapes | document
+
+where flags says whether the rest is compressed.
+"""
+import collections
+import json
+import struct
+import zlib
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import prov.model
+from prov.serializers.provjson import decode_json_document
+
+
+MAGIC = b"PVB"
+VERSION = 1
+_COMPRESSED = 1
+
+# Value tags.
+_NULL, _TRUE, _FALSE, _INT, _FLOAT, _STRING, _LIST, _DICT, _TYPED, \
+    _RECORDS = range(10)
+# Column tags in a table of records.
+_VALUES, _STRINGS, _TYPED_STRINGS = range(3)
+_DOUBLE = struct.Struct("<d")
+
+
+class BadBinaryDocument(Exception):
+    """
+    The bytes aren't a document in this format, or are from
+    a newer version of it.
+    """
+    pass
+
+
+def _varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def _typed(value):
+    return isinstance(value, Mapping) and len(value) == 2 and \
+        list(value) == ["$", "type"] and isinstance(value["type"], str)
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.strings = dict()
+        self.shapes = dict()
+        self.body = bytearray()
+
+    def index(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = len(self.strings)
+            self.strings[text] = index
+        return index
+
+    def string(self, text):
+        _varint(self.body, self.index(text))
+
+    def string_column(self, texts):
+        """
+        Strings as differences from the one before, because
+        a column's strings are usually new, and so numbered in order.
+        """
+        out = self.body
+        previous = 0
+        for text in texts:
+            index = self.index(text)
+            _varint(out, _zigzag(index - previous))
+            previous = index
+
+    def value(self, value):
+        out = self.body
+        if isinstance(value, str):
+            out.append(_STRING)
+            self.string(value)
+        elif value is None:
+            out.append(_NULL)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            out.append(_INT)
+            _varint(out, _zigzag(value))
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out.extend(_DOUBLE.pack(value))
+        elif isinstance(value, Mapping):
+            if _typed(value):
+                # A typed literal, such as {"$": "2", "type": "xsd:int"}.
+                out.append(_TYPED)
+                self.value(value["$"])
+                self.string(value["type"])
+            elif value and all(isinstance(v, Mapping)
+                               for v in value.values()):
+                self.records(value)
+            else:
+                out.append(_DICT)
+                _varint(out, len(value))
+                for key, item in value.items():
+                    self.string(key)
+                    self.value(item)
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            _varint(out, len(value))
+            for item in value:
+                self.value(item)
+        else:
+            raise TypeError("Can't encode {}".format(type(value)))
+
+    def document(self, document):
+        """
+        The top of a document maps each kind, such as "entity" or
+        "used", to its records, so each kind becomes one table.
+        """
+        out = self.body
+        out.append(_DICT)
+        _varint(out, len(document))
+        for kind, records in document.items():
+            self.string(kind)
+            self.value(records)
+
+    def records(self, records):
+        """
+        A dictionary of dictionaries, such as all the "used" relations,
+        as a table. Rows whose attributes have the same names share
+        a shape, and values are written a column at a time within
+        each shape, so that similar values sit together for zlib.
+        """
+        out = self.body
+        out.append(_RECORDS)
+        _varint(out, len(records))
+        self.string_column(records)
+        groups = dict()
+        for attributes in records.values():
+            shape = tuple(attributes)
+            index = self.shapes.get(shape)
+            if index is None:
+                index = len(self.shapes)
+                self.shapes[shape] = index
+            _varint(out, index)
+            groups.setdefault(shape, list()).append(attributes)
+        for shape, rows in groups.items():
+            for key in shape:
+                column = [attributes[key] for attributes in rows]
+                if all(isinstance(value, str) for value in column):
+                    out.append(_STRINGS)
+                    self.string_column(column)
+                elif all(_typed(value) and isinstance(value["$"], str) and
+                         value["type"] == column[0]["type"]
+                         for value in column):
+                    # Such as every unk:last_access, an xsd:dateTime.
+                    out.append(_TYPED_STRINGS)
+                    self.string(column[0]["type"])
+                    self.string_column([value["$"] for value in column])
+                else:
+                    out.append(_VALUES)
+                    for value in column:
+                        self.value(value)
+
+
+def encode(document, compress=True):
+    """
+    Encodes a provenance document.
+
+    :param document: A ProcessDocument, its ``as_dict()``, or its ``json()``.
+    :param compress: Whether to compress with zlib.
+    :return: bytes
+    """
+    if hasattr(document, "as_dict"):
+        document = document.as_dict()
+    elif not isinstance(document, Mapping):
+        document = json.loads(document)
+    encoder = _Encoder()
+    encoder.document(document)
+    # Shape keys go in the string table too, so shapes are
+    # encoded before the table is written.
+    shapes = bytearray()
+    _varint(shapes, len(encoder.shapes))
+    for shape in encoder.shapes:
+        _varint(shapes, len(shape))
+        for key in shape:
+            index = encoder.strings.get(key)
+            if index is None:
+                index = len(encoder.strings)
+                encoder.strings[key] = index
+            _varint(shapes, index)
+    # All the lengths, then all the strings, which compresses
+    # better than each length before its string.
+    encoded = [text.encode("utf-8") for text in encoder.strings]
+    tables = bytearray()
+    _varint(tables, len(encoded))
+    for text in encoded:
+        _varint(tables, len(text))
+    tables.extend(b"".join(encoded))
+    payload = bytes(tables + shapes + encoder.body)
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload)
+        flags |= _COMPRESSED
+    return MAGIC + bytes([VERSION, flags]) + payload
+
+
+class _Decoder(object):
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+        self.strings = list()
+        self.shapes = list()
+
+    def varint(self):
+        data = self.data
+        position = self.position
+        byte = data[position]
+        position += 1
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        self.position = position
+        return value
+
+    def string(self):
+        return self.strings[self.varint()]
+
+    def tables(self):
+        data = self.data
+        lengths = [self.varint() for _ in range(self.varint())]
+        position = self.position
+        for length in lengths:
+            self.strings.append(
+                data[position:position + length].decode("utf-8"))
+            position += length
+        self.position = position
+        for _ in range(self.varint()):
+            self.shapes.append(
+                tuple(self.string() for _ in range(self.varint())))
+
+    def string_column(self, count):
+        strings = self.strings
+        column = list()
+        index = 0
+        for _ in range(count):
+            index += _unzigzag(self.varint())
+            column.append(strings[index])
+        return column
+
+    def column(self, count):
+        tag = self.data[self.position]
+        self.position += 1
+        if tag == _STRINGS:
+            return self.string_column(count)
+        elif tag == _VALUES:
+            return [self.value() for _ in range(count)]
+        elif tag == _TYPED_STRINGS:
+            literal_type = self.string()
+            return [{"$": literal, "type": literal_type}
+                    for literal in self.string_column(count)]
+        raise BadBinaryDocument("Unknown column {} at {}".format(
+            tag, self.position - 1))
+
+    def records(self):
+        count = self.varint()
+        identifiers = self.string_column(count)
+        row_shapes = [self.varint() for _ in range(count)]
+        rows = collections.OrderedDict()
+        for index in row_shapes:
+            rows[index] = rows.get(index, 0) + 1
+        for index, total in rows.items():
+            shape = self.shapes[index]
+            columns = [self.column(total) for _ in shape]
+            rows[index] = iter([dict(zip(shape, values))
+                                for values in zip(*columns)] if shape
+                               else [dict() for _ in range(total)])
+        return {identifier: next(rows[index])
+                for (identifier, index) in zip(identifiers, row_shapes)}
+
+    def value(self):
+        tag = self.data[self.position]
+        self.position += 1
+        if tag == _STRING:
+            return self.string()
+        elif tag == _RECORDS:
+            return self.records()
+        elif tag == _TYPED:
+            literal = self.value()
+            return {"$": literal, "type": self.string()}
+        elif tag == _DICT:
+            result = dict()
+            for _ in range(self.varint()):
+                key = self.string()
+                result[key] = self.value()
+            return result
+        elif tag == _LIST:
+            return [self.value() for _ in range(self.varint())]
+        elif tag == _INT:
+            return _unzigzag(self.varint())
+        elif tag == _FLOAT:
+            value = _DOUBLE.unpack_from(self.data, self.position)[0]
+            self.position += _DOUBLE.size
+            return value
+        elif tag == _NULL:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        raise BadBinaryDocument("Unknown tag {} at {}".format(
+            tag, self.position - 1))
+
+
+def decode(data):
+    """
+    Decodes bytes from ``encode``.
+
+    :param data: bytes
+    :return: The PROV-JSON document as a dictionary.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise BadBinaryDocument("Not a binary provenance document")
+    version, flags = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version > VERSION:
+        raise BadBinaryDocument("Version {} is newer than {}".format(
+            version, VERSION))
+    payload = data[len(MAGIC) + 2:]
+    if flags & _COMPRESSED:
+        payload = zlib.decompress(payload)
+    decoder = _Decoder(payload)
+    try:
+        decoder.tables()
+        return decoder.value()
+    except (IndexError, UnicodeDecodeError) as err:
+        raise BadBinaryDocument("Truncated or corrupt: {}".format(err))
+
+
+def to_prov(data):
+    """
+    Decodes bytes from ``encode`` into a prov.model.ProvDocument.
+
+    :param data: bytes
+    :return: A prov.model.ProvDocument.
+    """
+    document = prov.model.ProvDocument()
+    decode_json_document(decode(data), document)
+    return document
@@ -0,0 +1,14 @@
+"""
+Where provda keeps what it computes once and reuses across processes.
+"""
+import os
+
+
+def cache_dir():
+    """
+    The PROVDA_CACHE environment variable, if set,
+    or ~/.cache/provda.
+    """
+    return os.environ.get(
+        "PROVDA_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "provda"))
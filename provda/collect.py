@@ -11,6 +11,9 @@ Take a look here: https://www.w3.org/TR/prov-dc/,
 http://xmlns.com/foaf/spec/.
 """
 import getpass
+import hashlib
+import json
+import logging
 import os
 import platform
 import pwd
@@ -23,9 +26,13 @@ try:
 except ImportError:
     from pathlib2 import Path  # Python 2.7
 import git
+from .cache import cache_dir
 from .rfc3339 import rfc3339
 
 
+logger = logging.getLogger("provda.collect")
+
+
 def who_ran_this_process():
     p = pwd.getpwuid(os.getuid())
     user = {"unk:fullname": p.pw_gecos,
@@ -33,18 +40,236 @@ def who_ran_this_process():
     return "people:"+getpass.getuser(), user
 
 
-def this_script():
+def _script_path():
     if sys.argv[0] in ["-c", "-m"]:
-        script_path = os.path.realpath(sys.argv[1])
+        return os.path.realpath(sys.argv[1])
     else:
-        script_path = os.path.realpath(sys.argv[0])
+        return os.path.realpath(sys.argv[0])
+
+
+def find_repository(path="."):
+    """
+    Looks in this directory and its parents for a git repository.
+
+    :param path: Where to start looking.
+    :return: The working directory and the .git directory, or
+             (None, None).
+    """
+    path = os.path.realpath(path)
+    while True:
+        candidate = os.path.join(path, ".git")
+        if os.path.isdir(candidate):
+            return path, candidate
+        elif os.path.isfile(candidate):
+            # A worktree or submodule has a file that points to its git dir.
+            with open(candidate, "r") as gitfile:
+                line = gitfile.readline().strip()
+            if line.startswith("gitdir:"):
+                return path, os.path.normpath(
+                    os.path.join(path, line[len("gitdir:"):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None, None
+        path = parent
+
+
+def find_git_dir(path="."):
+    """
+    Looks in this directory and its parents for a git repository.
+
+    :param path: Where to start looking.
+    :return: The path to the .git directory, or None.
+    """
+    return find_repository(path)[1]
+
+
+class UnusualRepository(Exception):
+    """
+    The repository is laid out in a way read_repository doesn't
+    understand, so ask git instead.
+    """
+    pass
 
+
+def _read_ref(git_dir, ref):
     try:
-        r = git.Repo(".", search_parent_directories=True)
-        repo = {
-            "unk:version_branch": r.active_branch.name,
-            "unk:version_branch_hash": r.active_branch.object.hexsha
+        with open(os.path.join(git_dir, ref), "r") as loose:
+            return loose.read().strip()
+    except (IOError, OSError):
+        pass
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), "r") as packed:
+            for line in packed:
+                if line.startswith("#") or line.startswith("^"):
+                    continue
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    except (IOError, OSError):
+        pass
+    raise UnusualRepository("No ref {}".format(ref))
+
+
+def _first_remote_url(git_dir):
+    """
+    The url of the first remote in .git/config, or None.
+    """
+    section = None
+    with open(os.path.join(git_dir, "config"), "r") as config:
+        for line in config:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line.startswith("["):
+                section = line
+                if section.startswith("[include"):
+                    raise UnusualRepository("config includes other files")
+            elif "insteadof" in line.lower():
+                raise UnusualRepository("config rewrites urls")
+            elif section is not None and section.startswith("[remote "):
+                name, _, value = line.partition("=")
+                if name.strip().lower() == "url":
+                    return value.strip()
+    return None
+
+
+def read_repository(working_dir, git_dir):
+    """
+    Reads the branch, commit, and first remote of a repository from
+    the files in its .git directory, without running git. A detached
+    HEAD has a commit and no branch. Raises UnusualRepository for a
+    linked worktree, or a config that includes files or rewrites urls.
+
+    :param working_dir: The top of the checkout.
+    :param git_dir: Its .git directory.
+    :return: A dictionary of repository traits.
+    """
+    if os.path.exists(os.path.join(git_dir, "commondir")):
+        raise UnusualRepository("linked worktree")
+    with open(os.path.join(git_dir, "HEAD"), "r") as head:
+        head_text = head.read().strip()
+    if not head_text.startswith("ref:"):
+        if len(head_text) != 40 or \
+                head_text.strip("0123456789abcdef"):
+            raise UnusualRepository("HEAD isn't a commit")
+        return {
+            "unk:version_branch_hash": head_text,
+            "unk:version_remote": _first_remote_url(git_dir) or "local"
         }
+    ref = head_text[len("ref:"):].strip()
+    if not ref.startswith("refs/heads/"):
+        raise UnusualRepository("HEAD isn't a branch")
+    repo = {
+        "unk:version_branch": ref[len("refs/heads/"):],
+        "unk:version_branch_hash": _read_ref(git_dir, ref),
+        "unk:version_remote": _first_remote_url(git_dir) or "local"
+    }
+    return repo
+
+
+def _common_dir(git_dir):
+    """
+    Where a linked worktree keeps branches and config, which is
+    the git directory itself for an ordinary checkout.
+    """
+    try:
+        with open(os.path.join(git_dir, "commondir"), "r") as common:
+            return os.path.normpath(
+                os.path.join(git_dir, common.read().strip()))
+    except (IOError, OSError):
+        return git_dir
+
+
+def _repository_state(git_dir):
+    """
+    A string that changes when HEAD moves, the branch changes,
+    or remotes are edited, without asking git. It reads HEAD, the
+    commit its branch names, and the config, which are each small.
+    """
+    common_dir = _common_dir(git_dir)
+    with open(os.path.join(git_dir, "HEAD"), "r") as head:
+        head_text = head.read().strip()
+    state = [head_text]
+    if head_text.startswith("ref:"):
+        try:
+            state.append(_read_ref(common_dir, head_text[4:].strip()))
+        except UnusualRepository:
+            state.append("missing")
+    try:
+        with open(os.path.join(common_dir, "config"), "r") as config:
+            state.append(config.read())
+    except (IOError, OSError):
+        state.append("missing")
+    return "\n".join(state)
+
+
+def this_script():
+    """
+    Describes the running script and the git repository it is in.
+    The answer is cached on disk, keyed by the script path and the state
+    of the repository's HEAD, so many tasks that run the same script
+    at the same commit inspect git once.
+
+    :return: The script's id and a dictionary of its traits.
+    """
+    script_path = _script_path()
+    if "GIT_DIR" in os.environ:
+        return _inspect_script(script_path)
+    git_dir = find_git_dir(".")
+    if git_dir is None:
+        return "code:"+script_path, {"unk:script": script_path}
+
+    key = hashlib.sha1("\n".join(
+        [script_path, os.getcwd(), git_dir, _repository_state(git_dir)]
+    ).encode("utf-8")).hexdigest()
+    cache_file = os.path.join(cache_dir(), "script-{}.json".format(key))
+    try:
+        with open(cache_file, "r") as cached:
+            script_id, me = json.load(cached)
+        return script_id, me
+    except (IOError, OSError, ValueError):
+        pass
+
+    script_id, me = _inspect_script(script_path)
+    try:
+        if not os.path.isdir(cache_dir()):
+            os.makedirs(cache_dir())
+        partial = "{}.{}".format(cache_file, os.getpid())
+        with open(partial, "w") as cached:
+            json.dump([script_id, me], cached)
+        os.rename(partial, cache_file)
+    except (IOError, OSError):
+        pass  # Another task wrote it, or there is no place to cache.
+    return script_id, me
+
+
+def _inspect_script(script_path):
+    working_dir, git_dir = find_repository(".")
+    if git_dir is not None and "GIT_DIR" not in os.environ:
+        try:
+            repo = read_repository(working_dir, git_dir)
+            try:
+                id = str(Path(script_path).relative_to(working_dir))
+            except ValueError:
+                id = script_path
+            me = {"unk:script": script_path}
+            me.update(repo)
+            return "code:"+id, me
+        except (UnusualRepository, IOError, OSError) as err:
+            logger.debug("Asking git about {}: {}".format(git_dir, err))
+    return _ask_git(script_path)
+
+
+def _ask_git(script_path):
+    try:
+        r = git.Repo(".", search_parent_directories=True)
+        if r.head.is_detached:
+            repo = {"unk:version_branch_hash": r.head.commit.hexsha}
+        else:
+            repo = {
+                "unk:version_branch": r.active_branch.name,
+                "unk:version_branch_hash": r.active_branch.object.hexsha
+            }
         if r.remotes:
             repo["unk:version_remote"] = list(r.remotes[0].urls)[0]
         else:
@@ -64,10 +289,15 @@ def this_script():
     return "code:"+id, me
 
 
-def this_process():
+def this_process(started=None):
     """
     Reading recipy/recipy, among other things.
+
+    :param started: When the process started, as from time.time().
+                    Defaults to now.
     """
+    if started is None:
+        started = time.time()
     if sys.argv[0] in ["-c", "-m"]:
         cmd_args = sys.argv[2:]
     else:
@@ -81,7 +311,7 @@ def this_process():
         "unk:hostname": socket.gethostname(),
         "unk:platform": platform.platform(),
         "unk:interpreter": sys.version.split('\n')[0],
-        "unk:date": rfc3339(time.time()),
+        "unk:date": rfc3339(started),
     }
     if "SGE_JOB_ID" in os.environ:
         me["unk:sge_job_id"] = os.environ["SGE_JOB_ID"]
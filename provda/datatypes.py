@@ -7,6 +7,10 @@ except ImportError:
     import __builtin__ as builtins  # Python 2
 import logging
 import string
+try:
+    from _string import formatter_field_name_split
+except ImportError:
+    formatter_field_name_split = str._formatter_field_name_split  # Python 2
 
 logger = logging.getLogger("provda.datatypes")
 
@@ -77,7 +81,118 @@ class FormatterMissing(string.Formatter):
 
         return ''.join(result)
 
-_vformat = FormatterMissing().vformat
+
+class CompiledTemplate(object):
+    """
+    A format string that has been split, once, into literal text and
+    field slots, so that resolving it against a mapping is a join over
+    pre-parsed pieces. Missing keys are left as plain text, as they are
+    for FormatterMissing.
+    """
+    def __init__(self, format_string, recursion_depth=2):
+        if recursion_depth < 0:
+            raise ValueError('Max string recursion exceeded')
+        self.format_string = format_string
+        self._pieces = list()
+        for literal_text, field_name, format_spec, conversion in \
+                _formatter.parse(format_string):
+            if literal_text:
+                self._pieces.append(literal_text)
+            if field_name is not None:
+                self._pieces.append(_FieldSlot(
+                    field_name, format_spec, conversion, recursion_depth))
+        if all(isinstance(p, str) for p in self._pieces):
+            self._literal = "".join(self._pieces)
+        else:
+            self._literal = None
+
+    def format(self, args, kwargs):
+        if self._literal is not None:
+            return self._literal
+        return "".join([p if p.__class__ is str else p.format(args, kwargs)
+                        for p in self._pieces])
+
+    def __repr__(self):
+        return "CompiledTemplate({!r})".format(self.format_string)
+
+
+class _FieldSlot(object):
+    """
+    One replacement field of a CompiledTemplate. It keeps the field name
+    already split into its first key and the attribute or index lookups
+    that follow, and the text to emit if the key is missing.
+    """
+    __slots__ = ("first", "rest", "conversion", "format_spec", "missing")
+
+    def __init__(self, field_name, format_spec, conversion, recursion_depth):
+        first, rest = formatter_field_name_split(field_name)
+        self.first = first
+        self.rest = tuple(rest)
+        self.conversion = conversion
+        if "{" in format_spec:
+            self.format_spec = CompiledTemplate(format_spec,
+                                                recursion_depth - 1)
+        else:
+            self.format_spec = format_spec
+        missing = ["{", field_name]
+        if format_spec != "":
+            missing.extend([":", format_spec])
+        if conversion is not None:
+            missing.extend(["!", conversion])
+        missing.append("}")
+        self.missing = "".join(missing)
+
+    def format(self, args, kwargs):
+        try:
+            if isinstance(self.first, builtins.int):
+                obj = args[self.first]
+            else:
+                obj = kwargs[self.first]
+            for is_attr, key in self.rest:
+                if is_attr:
+                    obj = getattr(obj, key)
+                else:
+                    obj = obj[key]
+            if obj is None:
+                raise KeyError(self.first)
+        except KeyError:
+            return self.missing
+        if self.conversion is not None:
+            obj = _formatter.convert_field(obj, self.conversion)
+        format_spec = self.format_spec
+        if format_spec.__class__ is CompiledTemplate:
+            format_spec = format_spec.format(args, kwargs)
+        return format(obj, format_spec)
+
+
+_formatter = FormatterMissing()
+# Templates are few and resolved often, so keep each one compiled.
+# The bound only guards against settings that rewrite their own value.
+_template_cache = dict()
+_TEMPLATE_CACHE_SIZE = 4096
+
+
+def compile_template(format_string):
+    """
+    Returns the CompiledTemplate for this format string, compiling
+    it on first use.
+
+    :param format_string str: A template such as "{acause}_{date}.csv".
+    :return: A CompiledTemplate.
+    """
+    try:
+        return _template_cache[format_string]
+    except KeyError:
+        pass
+    compiled = CompiledTemplate(format_string)
+    if len(_template_cache) >= _TEMPLATE_CACHE_SIZE:
+        _template_cache.clear()
+    _template_cache[format_string] = compiled
+    return compiled
+
+
+def _vformat(format_string, args, kwargs):
+    return compile_template(format_string).format(args, kwargs)
 
 
 class Setting(object):
@@ -0,0 +1,185 @@
+"""
+Content digests of files, computed once per version of a file.
+
+A digest is cached under the file's path, size, modification time,
+and inode, which change when the file is rewritten or replaced,
+so reading the same input in many steps, or many tasks, hashes it
+once. Large files are hashed through mmap, in chunks, so they are
+never in memory whole, and ``Digester`` hashes on a pool of threads
+so a job doesn't wait on its own provenance.
+"""
+import concurrent.futures
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+from .cache import cache_dir
+
+
+logger = logging.getLogger("provda.digest")
+
+_CHUNK = 1024 * 1024
+# Files at least this big are hashed through mmap.
+_MMAP_SIZE = 4 * _CHUNK
+
+
+def _key(path, stat):
+    mtime = getattr(stat, "st_mtime_ns", None) or stat.st_mtime
+    return (os.path.realpath(path), stat.st_size, mtime, stat.st_ino)
+
+
+def hash_file(path, size=None):
+    """
+    The SHA-256 of a file's contents, as hex, read in chunks.
+
+    :param path: The file.
+    :param size: Its size, if known, to choose between mmap and read.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        if size is None:
+            size = os.fstat(stream.fileno()).st_size
+        if size >= _MMAP_SIZE:
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, len(view), _CHUNK):
+                        digest.update(view[start:start + _CHUNK])
+                finally:
+                    view.release()
+            finally:
+                mapped.close()
+        else:
+            for block in iter(lambda: stream.read(_CHUNK), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class HashCache(object):
+    """
+    Digests keyed by (path, size, mtime, inode), in memory and,
+    if given a directory, on disk for other processes.
+    """
+    def __init__(self, directory=None, max_entries=65536):
+        """
+        :param directory: Where to keep digests between processes,
+                          or None to keep them only in memory.
+        :param max_entries: How many to keep in memory.
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = dict()
+        self._lock = threading.Lock()
+
+    def _disk_file(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".json")
+
+    def get(self, key):
+        with self._lock:
+            sha256 = self._memory.get(key)
+        if sha256 is not None or self.directory is None:
+            return sha256
+        try:
+            with open(self._disk_file(key), "r") as cached:
+                sha256 = json.load(cached)
+        except (IOError, OSError, ValueError):
+            return None
+        self._remember(key, sha256)
+        return sha256
+
+    def put(self, key, sha256):
+        self._remember(key, sha256)
+        if self.directory is None:
+            return
+        filename = self._disk_file(key)
+        try:
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            partial = "{}.{}".format(filename, os.getpid())
+            with open(partial, "w") as cached:
+                json.dump(sha256, cached)
+            os.rename(partial, filename)
+        except (IOError, OSError):
+            pass  # There is no place to cache.
+
+    def _remember(self, key, sha256):
+        with self._lock:
+            if len(self._memory) >= self.max_entries:
+                self._memory.clear()
+            self._memory[key] = sha256
+
+    def digest(self, path):
+        """
+        The SHA-256 of the file, from the cache if this version
+        of the file was hashed before.
+
+        :param path: The file.
+        :return: The digest as hex.
+        """
+        stat = os.stat(path)
+        key = _key(path, stat)
+        sha256 = self.get(key)
+        if sha256 is None:
+            sha256 = hash_file(path, stat.st_size)
+            # A file that changed while it was read has no one digest.
+            if _key(path, os.stat(path)) == key:
+                self.put(key, sha256)
+        return sha256
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    The HashCache shared by this process, which keeps digests in
+    the provda cache directory.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HashCache(os.path.join(cache_dir(), "digests"))
+    return _default_cache
+
+
+def file_digest(path):
+    """
+    The SHA-256 of a file's contents, as hex, using the default cache.
+
+    :param path: The file.
+    """
+    return default_cache().digest(path)
+
+
+class Digester(object):
+    """
+    Hashes files on a pool of threads. Hashing mostly waits on
+    the disk or runs in hashlib, which releases the GIL,
+    so it overlaps with the job's own work.
+    """
+    def __init__(self, workers=2, cache=None):
+        """
+        :param workers: How many threads hash at once.
+        :param cache: A HashCache. Defaults to the shared one.
+        """
+        self.cache = cache if cache is not None else default_cache()
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def submit(self, path):
+        """
+        Starts hashing a file.
+
+        :param path: The file.
+        :return: A concurrent.futures.Future of the hex digest.
+        """
+        return self._pool.submit(self.cache.digest, path)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
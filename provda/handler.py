@@ -3,7 +3,14 @@ import datetime
 import json
 import logging
 import logging.handlers
+import select
 import socket
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
 
 
 logger = logging.getLogger("provda.handler")
@@ -36,33 +43,46 @@ def send_tcp(record, host, port, timeout=10):
     `json lines
     <https://github.com/logstash-plugins/logstash-codec-json_lines>_`.
     This one works with `json_lines`. It won't work with the `json` filter.
+    It opens one connection for one document. Use a TCPSender to keep
+    connections open across documents.
 
-    :param record: A logger record.
+    :param record: A ProcessDocument or its serialized json.
     :param host: Hostname of logstash.
     :param port: Port is it on.
     :param timeout: A timeout in seconds.
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(timeout)
-    logger.debug("Sending to {}:{} record {}".format(host, port, record))
-    s.connect((host, port))
-
-    pfields = json.loads(record)
-    logger.debug(json.dumps(
-        pfields, sort_keys=True, indent=4, separators=(',', ': ')))
+    sender = TCPSender(host, port, timeout=timeout, connections=1, retries=0)
+    try:
+        sender.send(record)
+    finally:
+        sender.close()
+
+
+def json_lines(document):
+    """
+    Turns a provenance document into one json_lines record for each
+    entity, activity, relation, and namespace prefix it contains.
+
+    :param document: A ProcessDocument, its ``as_dict()``, or its ``json()``.
+    :return: An iterator over utf-8 encoded lines, each ending in a newline.
+    """
+    if hasattr(document, "as_dict"):
+        pfields = document.as_dict()
+    elif isinstance(document, Mapping):
+        pfields = document
+    else:
+        pfields = json.loads(document)
     document_id = list(pfields["activity"].keys())[0]
-    total = 0
-    for kind in pfields.keys():
-        for instance in pfields[kind].keys():
-            fields = dict()
-            if isinstance(pfields[kind], Mapping):
-                fields.update(pfields[kind])
-            elif hasattr(pfields[kind], "__getitem__"):
-                logger.error("It's a list? {}".format(pfields[kind]))
-                raise Exception("Passed a list in json")
+    stamp = datetime.datetime.now().isoformat()
+    for kind, instances in pfields.items():
+        if not isinstance(instances, Mapping):
+            logger.error("It's a list? {}".format(instances))
+            raise Exception("Passed a list in json")
+        for instance, attributes in instances.items():
+            if isinstance(attributes, Mapping):
+                fields = attributes
             else:
-                raise Exception("No fields")
-            stamp = datetime.datetime.now().isoformat()
+                fields = {"value": attributes}
             record = json.dumps(
                 {'@message': 'create_file3',
                  '@source_host': "withme",
@@ -72,8 +92,135 @@ def send_tcp(record, host, port, timeout=10):
                  'instance': instance,
                  '@timestamp': stamp,
                  "@fields": fields})
-            print("final json {}".format(record))
-            s.sendall(str.encode(record, encoding="utf-8") + b'\n')
-            total = total + 1
-    s.close()
-    logger.debug("sent {} objects".format(total))
+            yield record.encode("utf-8") + b'\n'
+
+
+class TCPSender(object):
+    """
+    Sends provenance documents as json_lines to logstash over a small
+    pool of persistent TCP connections. Records are joined into writes
+    of about ``batch_bytes``, and a connection that fails is reopened
+    with exponential backoff. One sender can be shared among threads.
+    """
+    def __init__(self, host, port, timeout=10, connections=2,
+                 batch_bytes=64 * 1024, retries=4, backoff=0.5):
+        """
+        :param host: Hostname of logstash.
+        :param port: Port it is on.
+        :param timeout: A timeout in seconds for connect and send.
+        :param connections: Most connections open at once.
+        :param batch_bytes: Size of each write to the socket.
+        :param retries: How many times to reconnect before giving up.
+        :param backoff: Seconds to wait before the first reconnect.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.batch_bytes = batch_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(connections)
+
+    def send(self, document):
+        """
+        Sends every record of one document.
+
+        :param document: A ProcessDocument, its ``as_dict()``,
+                         or its ``json()``.
+        :return: The number of records sent.
+        """
+        return self.send_lines(json_lines(document))
+
+    def send_lines(self, lines):
+        """
+        Sends records that are already json_lines.
+
+        :param lines: An iterable of bytes, each ending in a newline.
+        :return: The number of records sent.
+        """
+        total = 0
+        self._slots.acquire()
+        connection = None
+        try:
+            connection = self._checkout()
+            batch = list()
+            size = 0
+            for line in lines:
+                batch.append(line)
+                size += len(line)
+                total += 1
+                if size >= self.batch_bytes:
+                    connection = self._write(connection, b"".join(batch))
+                    batch = list()
+                    size = 0
+            if batch:
+                connection = self._write(connection, b"".join(batch))
+        except Exception:
+            if connection is not None:
+                connection.close()
+                connection = None
+            raise
+        finally:
+            if connection is not None:
+                self._idle.put(connection)
+            self._slots.release()
+        logger.debug("sent {} objects".format(total))
+        return total
+
+    def close(self):
+        """
+        Closes idle connections. The sender can still be used after.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _checkout(self):
+        """
+        Takes an idle connection, if there is one that logstash
+        hasn't closed. Returns None otherwise, and _write connects.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            readable, _, _ = select.select([connection], [], [], 0)
+            if not readable:
+                return connection
+            try:
+                if connection.recv(1, socket.MSG_PEEK):
+                    return connection
+            except (socket.error, OSError):
+                pass
+            connection.close()
+
+    def _connect(self):
+        logger.debug("Connecting to {}:{}".format(self.host, self.port))
+        return socket.create_connection((self.host, self.port), self.timeout)
+
+    def _write(self, connection, data):
+        """
+        Writes data, reconnecting if the connection has failed.
+        Returns the connection that worked.
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.sendall(data)
+                return connection
+            except (socket.error, OSError) as err:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                if attempt == self.retries:
+                    raise
+                logger.warning("Send to {}:{} failed, retry in {}s: {}".format(
+                    self.host, self.port, delay, err))
+                time.sleep(delay)
+                delay *= 2
@@ -1,4 +1,6 @@
 import logging
+import multiprocessing
+import time
 import h5py
 
 
@@ -8,17 +10,56 @@ logger = logging.getLogger("provda.hdf")
 def add_keys(filename, keys, group=None):
     """
     This adds key-value pairs to an HDF file. It puts them all
-    into attributes on a group called "/created".
+    into attributes on a group called "/created". If the group
+    is already there, the keys are added to it.
 
     :param filename str: The filename as a string
     :param keys: A dictionary of key-value pairs to add to the file.
     :param group: If you want to name the group something else, name it here.
     :return:
     """
-    f = h5py.File(filename)
-    if group is not None:
-        g = f.create_group(group)
-    else:
-        g = f.create_group("/created")
-    for k, v in keys.items():
-        g.attrs[k] = str(v)
+    attributes = {k: str(v) for (k, v) in keys.items()}
+    with h5py.File(filename, "a") as f:
+        g = f.require_group(group if group is not None else "/created")
+        g.attrs.update(attributes)
+
+
+def _timed_add_keys(filename_keys_group):
+    filename, keys, group = filename_keys_group
+    start = time.time()
+    try:
+        add_keys(filename, keys, group)
+        error = None
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return filename, time.time() - start, error
+
+
+def add_keys_many(filenames, keys, group=None, processes=None):
+    """
+    Adds the same key-value pairs to many HDF files, using a pool
+    of processes. Each file is opened once and closed before its
+    worker takes the next one. A file that fails doesn't stop the rest.
+
+    :param filenames: An iterable of filenames.
+    :param keys: A dictionary of key-value pairs to add to each file.
+    :param group: If you want to name the group something else, name it here.
+    :param processes: How many processes. Defaults to the number of cores.
+    :return: A list of (filename, seconds, error) in the order given,
+             where error is None or a description of what failed.
+    """
+    work = [(filename, keys, group) for filename in filenames]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_timed_add_keys, work)
+    finally:
+        pool.close()
+        pool.join()
+    for filename, seconds, error in results:
+        if error is not None:
+            logger.error("Could not add keys to {}: {}".format(
+                filename, error))
+        else:
+            logger.debug("Added keys to {} in {:.3f}s".format(
+                filename, seconds))
+    return results
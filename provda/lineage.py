@@ -0,0 +1,246 @@
+"""
+A local store of provenance documents from many runs, which answers
+which run wrote a file, which runs read it, and what a run read
+and wrote.
+
+It is a SQLite file with one row for each process (an activity) and
+one row for each file or table a process used or generated (an event),
+indexed by entity, activity, SGE job id, and time. Documents go in
+many at a time, in one transaction::
+
+    store = LineageStore("lineage.db")
+    store.ingest([document])
+    for activity in store.writers("/ihme/forecasting/all.hdf"):
+        print(activity["sge_job_id"], activity["hostname"])
+"""
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import json
+import logging
+import sqlite3
+
+
+logger = logging.getLogger("provda.lineage")
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity (
+    id TEXT PRIMARY KEY,
+    sge_job_id TEXT,
+    hostname TEXT,
+    started TEXT,
+    script TEXT,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS activity_job ON activity (sge_job_id);
+CREATE INDEX IF NOT EXISTS activity_started ON activity (started);
+CREATE TABLE IF NOT EXISTS event (
+    activity TEXT NOT NULL,
+    entity TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    time TEXT,
+    count INTEGER,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS event_entity ON event (entity, kind);
+CREATE INDEX IF NOT EXISTS event_activity ON event (activity, kind);
+CREATE INDEX IF NOT EXISTS event_time ON event (time);
+"""
+
+# PROV-JSON relations that become events, and which way each points.
+_EVENT_KINDS = {"used": "used", "wasGeneratedBy": "generated"}
+
+
+def _plain(value):
+    """
+    PROV-JSON writes a typed value as {"$": value, "type": type}
+    and an attribute with many values as a list.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, Mapping):
+        value = value.get("$")
+    return value
+
+
+def _entity_id(path):
+    path = str(path)
+    return path if path.startswith("doc:") else "doc:" + path
+
+
+def _document_dict(document):
+    if hasattr(document, "as_dict"):
+        return document.as_dict()
+    elif isinstance(document, Mapping):
+        return document
+    else:
+        return json.loads(document)
+
+
+def _rows(document):
+    """
+    Activity rows and event rows for one PROV-JSON document.
+    """
+    activities = list()
+    scripts = dict()
+    events = list()
+    for kind, event_kind in _EVENT_KINDS.items():
+        for relations in document.get(kind, {}).values():
+            if isinstance(relations, Mapping):
+                relations = [relations]
+            for relation in relations:
+                activity = relation.get("prov:activity")
+                entity = relation.get("prov:entity")
+                if activity is None or entity is None:
+                    continue
+                if entity.startswith("code:"):
+                    scripts[activity] = entity
+                count = _plain(relation.get("unk:access_count"))
+                events.append((
+                    activity, entity, event_kind,
+                    _plain(relation.get("prov:time")),
+                    int(count) if count is not None else 1,
+                    _plain(relation.get("unk:sha256"))))
+    for identifier, attributes in document.get("activity", {}).items():
+        if isinstance(attributes, list):
+            attributes = attributes[0]
+        activities.append((
+            identifier,
+            _plain(attributes.get("unk:sge_job_id")),
+            _plain(attributes.get("unk:hostname")),
+            _plain(attributes.get("unk:date")),
+            scripts.get(identifier),
+            json.dumps(attributes)))
+    return activities, events
+
+
+class LineageStore(object):
+    """
+    Provenance from many runs, in a SQLite file.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: The database file. It is created if missing.
+                         Use ":memory:" for a store that isn't kept.
+        """
+        self.filename = filename
+        self._connection = sqlite3.connect(filename)
+        self._connection.row_factory = sqlite3.Row
+        # Readers don't wait on a writer, and a commit needn't sync twice.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def ingest(self, documents):
+        """
+        Adds documents in one transaction. A document that was added
+        before replaces what was recorded for its activities, so
+        ingesting a document twice doesn't count its events twice.
+
+        :param documents: An iterable of ProcessDocuments,
+                          their ``as_dict()``, or their ``json()``.
+        :return: The number of events added.
+        """
+        activities = list()
+        events = list()
+        for document in documents:
+            document_activities, document_events = _rows(
+                _document_dict(document))
+            activities.extend(document_activities)
+            events.extend(document_events)
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM event WHERE activity = ?",
+                [(row[0],) for row in activities])
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO activity VALUES (?, ?, ?, ?, ?, ?)",
+                activities)
+            self._connection.executemany(
+                "INSERT INTO event VALUES (?, ?, ?, ?, ?, ?)", events)
+        logger.debug("Ingested {} activities and {} events".format(
+            len(activities), len(events)))
+        return len(events)
+
+    def _activities_by_entity(self, path, kind):
+        return self._connection.execute(
+            "SELECT activity.*, event.time AS time, event.count AS count, "
+            "event.sha256 AS sha256 FROM event "
+            "JOIN activity ON activity.id = event.activity "
+            "WHERE event.entity = ? AND event.kind = ? ORDER BY event.time",
+            (_entity_id(path), kind)).fetchall()
+
+    def writers(self, path):
+        """
+        The runs that wrote a file or table, oldest first.
+
+        :param path: A file path, a "database/schema/table",
+                     or an entity id such as "doc:/path".
+        :return: A list of rows, which act like dictionaries, with the
+                 activity's columns and the event's time, count, and sha256.
+        """
+        return self._activities_by_entity(path, "generated")
+
+    def readers(self, path):
+        """
+        The runs that read a file or table, oldest first.
+
+        :param path: A file path, a "database/schema/table",
+                     or an entity id such as "doc:/path".
+        :return: A list of rows, as for ``writers``.
+        """
+        return self._activities_by_entity(path, "used")
+
+    def _entities_by_activity(self, activity, kind):
+        return self._connection.execute(
+            "SELECT * FROM event WHERE activity = ? AND kind = ? "
+            "ORDER BY time", (activity, kind)).fetchall()
+
+    def inputs(self, activity):
+        """
+        What a run read, including its script.
+
+        :param activity: The activity id, such as "is:1e5c...".
+        :return: A list of event rows.
+        """
+        return self._entities_by_activity(activity, "used")
+
+    def outputs(self, activity):
+        """
+        What a run wrote.
+
+        :param activity: The activity id, such as "is:1e5c...".
+        :return: A list of event rows.
+        """
+        return self._entities_by_activity(activity, "generated")
+
+    def activities(self, sge_job_id=None, start=None, end=None):
+        """
+        Runs with this SGE job id, or that started in a time range,
+        or both.
+
+        :param sge_job_id: The job id as a string.
+        :param start: Earliest start, as an RFC 3339 string.
+        :param end: Latest start, as an RFC 3339 string.
+        :return: A list of activity rows.
+        """
+        clauses = list()
+        values = list()
+        if sge_job_id is not None:
+            clauses.append("sge_job_id = ?")
+            values.append(str(sge_job_id))
+        if start is not None:
+            clauses.append("started >= ?")
+            values.append(start)
+        if end is not None:
+            clauses.append("started <= ?")
+            values.append(end)
+        query = "SELECT * FROM activity"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return self._connection.execute(
+            query + " ORDER BY started", values).fetchall()
+
+    def close(self):
+        self._connection.close()
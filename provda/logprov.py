@@ -1,5 +1,6 @@
 import logging
 import sys
+import time
 
 
 class ProvLogger(logging.Logger):
@@ -15,6 +16,46 @@ class ProvLogger(logging.Logger):
     def __init__(self, name, level=logging.NOTSET):
         super(ProvLogger, self).__init__(name, level)
 
+    def _provenance_handlers(self):
+        """
+        If every handler that would see a provenance record takes
+        provenance directly, through a ``handle_prov`` method, this
+        returns them. Otherwise it returns None, and the record goes
+        through logging as usual.
+        """
+        handlers = list()
+        logger = self
+        while logger is not None:
+            if logger.filters:
+                return None
+            for handler in logger.handlers:
+                if logging.DEBUG < handler.level:
+                    continue  # It wouldn't get the record anyway.
+                elif hasattr(handler, "handle_prov"):
+                    handlers.append(handler)
+                else:
+                    return None
+            if not logger.propagate:
+                break
+            logger = logger.parent
+        return handlers
+
+    def _log_prov(self, msg, args, prov):
+        """
+        Sends provenance to handlers without making a LogRecord,
+        when they can take it that way.
+        """
+        if self.disabled:
+            return
+        handlers = self._provenance_handlers()
+        if handlers is None:
+            # Use _log because self.log can exclude msg based on level.
+            self._log(logging.DEBUG, msg, args, extra={"prov": prov})
+        else:
+            created = time.time()
+            for handler in handlers:
+                handler.handle_prov(prov, created)
+
     def write_file(self, file_path, role, *args, **kwargs):
         """
         Messages created by create_file have a dictionary of extra
@@ -25,11 +66,9 @@ class ProvLogger(logging.Logger):
         :param args: Any extra args
         :param kwargs: and extra keyword args.
         """
-        # Use _log because self.log can exclude msg based on level.
         kw = {"path": file_path, "kind": "create_file", "role": role}
         kw.update(kwargs)
-        self._log(logging.DEBUG, "ProvWrite".format(file_path), args,
-                  extra={"prov": kw})
+        self._log_prov("ProvWrite", args, kw)
 
     def read_file(self, file_path, role, *args, **kwargs):
         """
@@ -42,8 +81,7 @@ class ProvLogger(logging.Logger):
         """
         kw = {"path": file_path, "kind": "read_file", "role": role}
         kw.update(kwargs)
-        self._log(logging.DEBUG, "ProvRead".format(file_path), args,
-                  extra={"prov": kw})
+        self._log_prov("ProvRead", args, kw)
 
     def write_table(self, database, schema, table, role, *args, **kwargs):
         """
@@ -59,8 +97,7 @@ class ProvLogger(logging.Logger):
         kw = {"database": database, "schema": schema, "table": table,
               "kind": "write_table", "role": role}
         kw.update(kwargs)
-        self._log(logging.DEBUG, "ProvWrite {}".format(kw), args,
-                  extra={"prov": kw})
+        self._log_prov("ProvWrite {}".format(kw), args, kw)
 
     def read_table(self, database, schema, table, role, *args, **kwargs):
         """
@@ -76,8 +113,7 @@ class ProvLogger(logging.Logger):
         kw = {"database": database, "schema": schema, "table": table,
               "kind": "read_table", "role": role}
         kw.update(kwargs)
-        self._log(logging.DEBUG, "ProvRead {}".format(kw), args,
-                  extra={"prov": kw})
+        self._log_prov("ProvRead {}".format(kw), args, kw)
 
     def start_tasks(self, executable, task_ids, *args, **kwargs):
         """
@@ -88,9 +124,9 @@ class ProvLogger(logging.Logger):
         :param executable: The name of the executable we are starting.
         :param task_ids: The job ids of the started jobs.
         """
-        self._log(logging.DEBUG, "ProvTasks {}".format(task_ids), args,
-                  extra={"prov": {"executable": executable,
-                                  "ids": task_ids, "kind": "start_tasks"}})
+        self._log_prov("ProvTasks {}".format(task_ids), args,
+                       {"executable": executable, "ids": task_ids,
+                        "kind": "start_tasks"})
 
 
 logging.setLoggerClass(ProvLogger)
@@ -1,11 +1,19 @@
 """
 This class is the document that stores provenance.
 """
+import atexit
 import collections
+import datetime
 import logging
+import os
+import threading
+import time
 import uuid
+import weakref
 import prov.model
-from . import collect
+from prov.serializers.provjson import encode_json_document
+from . import binary, collect, streaming
+from .digest import Digester
 
 
 logger = logging.getLogger("prov.model")
@@ -24,7 +32,7 @@ class ProcessDocument:
     This represents process-level provenance. There will be one per process.
     It can act as a logging.Handler for logging.
     """
-    def __init__(self, namespaces):
+    def __init__(self, namespaces, digests=False):
         """
         If namespaces includes ("is", "https://healthdata.org/instances"),
         then the qualified_process_name could be "is:scalars-step-3".
@@ -33,9 +41,28 @@ class ProcessDocument:
         "code" for software code, and "doc" is a file or table.
 
         :param namespaces: An iterable of (short, long) namespaces.
+        :param digests: If True, or a provda.digest.Digester, each use or
+                        generation of a file gets an "unk:sha256" of its
+                        contents. Files read are hashed in the background
+                        when first read. Files written are hashed when
+                        the document is serialized.
         """
         self._document = prov.model.ProvDocument()
         self._targets = list()
+        # Files and tables are entered once, however often they are used.
+        # The relation index maps (kind, activity, entity) to
+        # [relation, count, last access time].
+        self._entities = dict()
+        self._relations = dict()
+        # Maps a relation's key to a Future of the file's digest,
+        # or to None for a file written, which is hashed later.
+        self._digests = dict()
+        # Maps a relation's key to [seconds, bytes counted, calls whose
+        # bytes weren't counted, path] for its timed reads or writes.
+        self._io = dict()
+        if digests is True:
+            digests = Digester()
+        self._digester = digests or None
 
         if isinstance(namespaces, collections.Mapping):
             namespaces = namespaces.items()
@@ -50,18 +77,32 @@ class ProcessDocument:
         for short, long in default_namespaces.items():
             self._document.add_namespace(short, long)
 
+        # What the script, person, and process are gets filled in
+        # when the document is serialized. Only the start time is now.
+        self._started = time.time()
+        self._collected = False
+        self._script = None
+        self._process_id = "is:"+str(uuid.uuid4())
+        self.process = self._document.activity(self._process_id)
+        self.level = logging.DEBUG
+
+    def _collect(self):
+        """
+        Adds the script, the person running it, and traits of this
+        process, the first time the document is serialized.
+        """
+        if self._collected:
+            return
+        self._collected = True
         script_id, script_traits = collect.this_script()
-        script_entity = self._document.entity(
-            script_id, other_attributes=script_traits)
+        script_entity = self._entity(script_id, script_traits)
+        self._script = script_entity
         who_id, who_traits = collect.who_ran_this_process()
         runner_agent = self._document.agent(
             who_id, other_attributes=who_traits)
-        process_traits = collect.this_process()
-        self.process = self._document.activity(
-            "is:"+str(uuid.uuid4()), other_attributes=process_traits)
+        self.process.add_attributes(collect.this_process(self._started))
         self.process.used(script_entity)
         self.process.wasAssociatedWith(runner_agent)
-        self.level = logging.DEBUG
 
     def setLevel(self, level):
         pass
@@ -71,38 +112,352 @@ class ProcessDocument:
         return hasattr(record, "prov")
 
     def handle(self, record):
-        if not hasattr(record, "prov"):
-            print("Where is the prov? {}".format(record))
-            raise Exception("Every record at this point should be filtered.")
-        p = record.prov
-        if p["kind"] == "create_file":
-            file_id = self._document.entity("doc:"+str(p["path"]))
-            file_id.wasGeneratedBy(self.process)
-        elif p["kind"] == "read_file":
-            file_id = self._document.entity("doc:"+str(p["path"]))
-            self.process.used(file_id)
-        elif p["kind"] == "write_table":
+        # Logger.callHandlers doesn't filter, and a document on the root
+        # logger sees every message.
+        if not self.filter(record):
+            return
+        self.handle_prov(record.prov, getattr(record, "created", None))
+
+    def handle_prov(self, prov, created):
+        """
+        Takes provenance straight from a ProvLogger, with no LogRecord.
+
+        :param prov: The provenance dictionary.
+        :param created: When it was logged, as from time.time().
+        """
+        self._apply(prov, created)
+
+    def _apply(self, p, created=None):
+        """
+        Adds one provenance record to the document.
+
+        :param p: The ``prov`` dictionary of a LogRecord.
+        :param created: When it was logged, as from time.time().
+        """
+        if created is None:
+            created = time.time()
+        kind = p["kind"]
+        if kind == "create_file":
+            self._access("generation", "doc:"+str(p["path"]), created,
+                         p["path"], p.get("duration"), p.get("bytes"))
+        elif kind == "read_file":
+            self._access("usage", "doc:"+str(p["path"]), created, p["path"],
+                         p.get("duration"), p.get("bytes"))
+        elif kind == "write_table":
             id = "{}/{}/{}".format(p["database"], p["schema"], p["table"])
-            table_id = self._document.entity("doc:"+id)
-            table_id.wasGeneratedBy(self.process)
-        elif p["kind"] == "read_table":
+            self._access("generation", "doc:"+id, created)
+        elif kind == "read_table":
             id = "{}/{}/{}".format(p["database"], p["schema"], p["table"])
-            table_id = self._document.entity("doc:" + id)
-            self.process.used(table_id)
+            self._access("usage", "doc:" + id, created)
         elif p["kind"] == "start_tasks":
             id = "unk:processcollection"
-            subprocesses = self._document.collection(id)
+            subprocesses = self._entity(id, collection=True)
             for task in p["ids"]:
-                sub_proc = self._document.entity("doc:"+str(task),
-                                                 {"unk:task_id": task})
+                sub_proc = self._entity("doc:"+str(task),
+                                        {"unk:task_id": task})
                 self._document.membership(subprocesses, sub_proc)
-            self._document.influence(subprocesses, self.process)
+            key = ("influence", self._process_id, id)
+            if key not in self._relations:
+                self._relations[key] = [
+                    self._document.influence(subprocesses, self.process),
+                    1, created]
         else:
             raise RuntimeError("Unknown type of provenance record {}".format(
                 p["kind"]))
 
+    def _entity(self, identifier, other_attributes=None, collection=False):
+        entity = self._entities.get(identifier)
+        if entity is None:
+            if collection:
+                entity = self._document.collection(identifier,
+                                                   other_attributes)
+            else:
+                entity = self._document.entity(identifier, other_attributes)
+            self._entities[identifier] = entity
+        return entity
+
+    def _access(self, kind, identifier, created, path=None, duration=None,
+                size=None):
+        """
+        Records that this process used or generated an entity. The
+        first access makes the relation. Later ones only count.
+
+        :param kind: Either "usage" or "generation".
+        :param identifier: The entity read or written, as "doc:path".
+        :param created: Seconds since the epoch.
+        :param path: The file, if the entity is one, for its digest.
+        :param duration: Seconds the read or write took, if measured.
+        :param size: Bytes read or written, if measured.
+        """
+        key = (kind, self._process_id, identifier)
+        if duration is not None or size is not None:
+            io = self._io.get(key)
+            if io is None:
+                io = [0.0, 0, 0, path]
+                self._io[key] = io
+            if duration is not None:
+                io[0] += duration
+            if size is not None:
+                io[1] += size
+            else:
+                io[2] += 1
+        seen = self._relations.get(key)
+        if seen is not None:
+            seen[1] += 1
+            seen[2] = created
+            return
+        entity = self._entity(identifier)
+        when = datetime.datetime.fromtimestamp(created)
+        if kind == "usage":
+            relation = self._document.usage(self.process, entity, when)
+        else:
+            relation = self._document.generation(entity, self.process, when)
+        self._relations[key] = [relation, 1, created]
+        if self._digester is not None and path is not None:
+            if kind == "usage":
+                self._digests[key] = (path, self._digester.submit(path))
+            else:
+                self._digests[key] = (path, None)
+
+    def _add_digests(self):
+        """
+        Waits for digests of files read, hashes files written, and puts
+        each digest on its relation. A file that is gone, or a path
+        that isn't a file, gets no digest.
+        """
+        waiting = list()
+        for key, (path, future) in self._digests.items():
+            if key[0] == "generation":
+                # The file may have been written again since the last time.
+                future = self._digester.submit(path)
+            waiting.append((key, path, future))
+        for key, path, future in waiting:
+            try:
+                sha256 = future.result()
+            except (IOError, OSError, TypeError, ValueError) as err:
+                logger.debug("No digest for {}: {}".format(path, err))
+                continue
+            _replace_attribute(self._relations[key][0], "unk:sha256", sha256)
+
+    def _add_io(self):
+        """
+        Puts the total seconds and bytes of each relation's reads or
+        writes on it, and their throughput in bytes per second.
+        A call that didn't count its bytes read the whole file, or
+        wrote what the file holds now, so the file's size is found
+        here, once, instead of with a stat in every call.
+        """
+        for key, (seconds, size, uncounted, path) in self._io.items():
+            if uncounted:
+                try:
+                    file_size = os.stat(path).st_size
+                except (OSError, TypeError, ValueError):
+                    file_size = None
+                if file_size is None:
+                    size = size or None
+                elif key[0] == "usage":
+                    size += uncounted * file_size
+                else:
+                    size += file_size
+            relation = self._relations[key][0]
+            _replace_attribute(relation, "unk:io_seconds", seconds)
+            if size is not None:
+                _replace_attribute(relation, "unk:io_bytes", size)
+                if seconds > 0:
+                    _replace_attribute(relation, "unk:io_bytes_per_second",
+                                       size / seconds)
+
+    def _settle(self):
+        """
+        Collects process traits and writes access counts and last
+        access times onto relations before the document is serialized.
+        """
+        self._collect()
+        if self._digests:
+            self._add_digests()
+        if self._io:
+            self._add_io()
+        for relation, count, last in self._relations.values():
+            if count > 1:
+                _replace_attribute(relation, "unk:access_count", count)
+                _replace_attribute(relation, "unk:last_access",
+                                   datetime.datetime.fromtimestamp(last))
+
     def json(self):
+        self._settle()
         return self._document.serialize(format="json")
 
+    def as_dict(self):
+        """
+        The PROV-JSON form of the document as a dictionary, without
+        writing it to a string.
+        """
+        self._settle()
+        return encode_json_document(self._document)
+
+    def settled_dict(self):
+        """
+        The PROV-JSON, as a dictionary, of what the logged records
+        don't say by themselves: the process, its script and who ran
+        it, and the relations that were repeated, timed, or hashed.
+        Something that already keeps each record needs only this.
+        """
+        self._settle()
+        settled = set(self._io) | set(self._digests)
+        logged = set()
+        for key, (relation, count, last) in self._relations.items():
+            if count == 1 and key not in settled:
+                logged.add(id(relation))
+        logged.update(id(entity) for entity in self._entities.values()
+                      if entity is not self._script)
+        summary = prov.model.ProvDocument()
+        for namespace in self._document.get_registered_namespaces():
+            summary.add_namespace(namespace)
+        for record in self._document.get_records():
+            if id(record) not in logged:
+                summary.add_record(record)
+        return encode_json_document(summary)
+
+    def binary(self, compress=True):
+        """
+        The document in provda's compact binary form, which
+        ``provda.binary.to_prov`` reads back.
+
+        :param compress: Whether to compress with zlib.
+        :return: bytes
+        """
+        return binary.encode(self.as_dict(), compress)
+
+    def write_json(self, stream):
+        """
+        Writes PROV-JSON to a stream a record at a time, so a large
+        document isn't first made into one string.
+
+        :param stream: A text stream open for writing.
+        """
+        self._settle()
+        streaming.write_json(self._document, stream)
+
+    def write_provn(self, stream):
+        """
+        Writes PROV-N to a stream a record at a time.
+
+        :param stream: A text stream open for writing.
+        """
+        self._settle()
+        streaming.write_provn(self._document, stream)
+
     def __str__(self):
+        self._settle()
         return self._document.get_provn()
+
+
+def _replace_attribute(record, name, value):
+    """
+    The prov library only adds attribute values, so a count that
+    changes would accumulate every value it had. This replaces them.
+    """
+    qualified = record.bundle.valid_qualified_name(name)
+    values = record._attributes[qualified]
+    values.clear()
+    values.add(value)
+
+
+def _close_at_exit(reference):
+    document = reference()
+    if document is not None:
+        document.close()
+
+
+class BatchedProcessDocument(ProcessDocument):
+    """
+    A ProcessDocument which, as a logging handler, only queues the
+    provenance from each record. A background thread adds queued
+    records to the document in batches, so the thread that reads and
+    writes files doesn't pay for building prov objects.
+    Serializing the document flushes the queue first.
+    """
+    def __init__(self, namespaces, batch_size=1000, interval=1.0,
+                 digests=False):
+        """
+        :param namespaces: An iterable of (short, long) namespaces.
+        :param batch_size: Wake the background thread when this many
+                           records are waiting.
+        :param interval: Seconds between flushes when few records arrive.
+        :param digests: Whether to hash files, as for ProcessDocument.
+        """
+        ProcessDocument.__init__(self, namespaces, digests)
+        self.batch_size = batch_size
+        self.interval = interval
+        # deque.append and popleft are atomic, so handle() takes no lock.
+        self._pending = collections.deque()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="provda-batched-document")
+        self._thread.daemon = True
+        self._thread.start()
+        # A weak reference, so a closed document isn't kept until exit.
+        atexit.register(_close_at_exit, weakref.ref(self))
+
+    def handle_prov(self, prov, created):
+        self._pending.append((prov, created))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Adds every queued record to the document before returning.
+        """
+        with self._flush_lock:
+            self._drain()
+
+    def _drain(self):
+        pending = self._pending
+        while pending:
+            self._apply(*pending.popleft())
+
+    def _locked(self, serialize, *args):
+        """
+        Flushes, settles, and serializes while holding the flush lock,
+        so the background thread can't add to the document meanwhile.
+        """
+        with self._flush_lock:
+            self._drain()
+            return serialize(self, *args)
+
+    def close(self):
+        """
+        Stops the background thread and flushes what remains.
+        This is registered to run at exit.
+        """
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._thread.join()
+        self.flush()
+
+    def json(self):
+        return self._locked(ProcessDocument.json)
+
+    def as_dict(self):
+        return self._locked(ProcessDocument.as_dict)
+
+    def settled_dict(self):
+        return self._locked(ProcessDocument.settled_dict)
+
+    def write_json(self, stream):
+        self._locked(ProcessDocument.write_json, stream)
+
+    def write_provn(self, stream):
+        self._locked(ProcessDocument.write_provn, stream)
+
+    def __str__(self):
+        return self._locked(ProcessDocument.__str__)
@@ -4,15 +4,25 @@ This module is responsible for reading settings files and storing provenance.
 It copies the pattern (and code) from the logging module so that
 each client Python module can have a local settings object.
 """
+import bisect
 import collections
 import copy
+import hashlib
 import json
 import logging
 import os
+import pickle
 import yaml
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader  # PyYAML without libyaml
+from . import datatypes
+from .cache import cache_dir
 from .datatypes import Setting
 
-__all__ = ["get_parameters", "namespace_settings", "read_json"]
+__all__ = ["get_parameters", "namespace_settings", "read_json", "freeze",
+           "install", "load_frozen", "load_settings"]
 
 __author__ = "Andrew Dolgert <adolgert@uw.edu>"
 __status__ = "development"
@@ -23,6 +33,20 @@ logger = logging.getLogger("provda.parameters")
 # and sub-parameter sets, delineated by a period-separated
 # hierarchical value, which would be a module name.
 
+# Every Parameters object caches the values it has resolved. Any change
+# to any settings bumps this generation, and a cache from an older
+# generation is thrown away on the next read.
+_generation = 0
+_NOT_CACHED = object()
+# Resolved values of these types can be handed out without a copy.
+_IMMUTABLE = frozenset([type(None), bool, int, float, complex, str, bytes,
+                        tuple, frozenset])
+
+
+def _settings_changed():
+    global _generation
+    _generation += 1
+
 
 class NoSuchParameter(Exception):
     """
@@ -67,6 +91,9 @@ class Manager(object):
         logger.debug("Manager.__init__ enter")
         self.root = rootnode
         self.parameters_dict = dict()
+        # Maps each setting name to the Parameters objects that define it,
+        # so an unqualified flag finds them without a scan.
+        self.defined_by = collections.defaultdict(set)
 
     def get_parameters(self, name, default_dict=None):
         logger.debug("get_parameters {}: {}".format(
@@ -89,6 +116,8 @@ class Manager(object):
                 parameters_instance.manager = self
                 self.parameters_dict[name] = parameters_instance
                 self._fixup_parents(parameters_instance)
+            # A new node changes which parent answers for a name.
+            _settings_changed()
 
             if default_dict is not None:
                 parameters_instance.init(default_dict)
@@ -198,6 +227,8 @@ class Parameters(collections.Mapping):
         self.name = name
         self.parent = None
         self._items = dict()
+        self._cache = dict()
+        self._cache_generation = _generation
 
     def __repr__(self):
         return 'provda.Parameters("{}")'.format(self.name)
@@ -206,10 +237,15 @@ class Parameters(collections.Mapping):
         return self.__repr__()
 
     def init(self, settings_dict):
+        _settings_changed()
         self._items.update(settings_dict)
+        if self is not self.root:
+            for name in settings_dict:
+                self.manager.defined_by[name].add(self)
 
     def update(self, settings_dict):
         logger.debug("parameters.update {}".format(settings_dict))
+        _settings_changed()
         for flag, raw_value in settings_dict.items():
             if flag in self._items:
                 self._items[flag].set(raw_value)
@@ -227,16 +263,33 @@ class Parameters(collections.Mapping):
 
     def __getitem__(self, name):
         """
-        Mapping interface
+        Mapping interface. Resolved values are cached until any
+        settings change, and mutable values are copied on every read.
         :param name:
         :return:
         """
-        logger.debug("getitem called for {}".format(name))
+        if self._cache_generation != _generation:
+            self._cache.clear()
+            self._cache_generation = _generation
+        rv = self._cache.get(name, _NOT_CACHED)
+        if rv is _NOT_CACHED:
+            rv = self._resolve(name)
+            self._cache[name] = rv
+        if type(rv) in _IMMUTABLE:
+            return rv
+        return copy.copy(rv)
+
+    def _resolve(self, name):
+        if self.frozen is not None:
+            values = self.frozen.get(self.name)
+            if values is not None and name in values:
+                return values[name]
         if name in self._items:
             retval = self._items[name]
-            logger.debug("name {} is type {} and value {}".format(
-                name, type(retval), retval
-            ))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("name {} is type {} and value {}".format(
+                    name, type(retval), retval
+                ))
             if isinstance(retval, Setting):
                 rv = retval.get(self)
                 if rv is None:
@@ -245,7 +298,7 @@ class Parameters(collections.Mapping):
             else:
                 return copy.copy(retval)
         elif self.parent is not None:
-            return self.parent.__getitem__(name)
+            return self.parent[name]
         else:
             raise KeyError(name)
 
@@ -290,9 +343,43 @@ class RootParameters(Parameters):
         Parameters.__init__(self, "root")
 
 
+class FrozenParameters(collections.Mapping):
+    """
+    A fully-resolved copy of every Parameters object, keyed by qualified
+    name. Each entry maps setting names to values with templates already
+    expanded and inheritance from parents already collapsed, so it is
+    a plain dict of dicts that pickles cheaply to worker processes.
+    """
+    def __init__(self, resolved):
+        self._resolved = resolved
+
+    def __getitem__(self, qualified):
+        return self._resolved[qualified]
+
+    def __iter__(self):
+        return iter(self._resolved)
+
+    def __len__(self):
+        return len(self._resolved)
+
+    def __repr__(self):
+        return "provda.FrozenParameters({} modules)".format(len(self))
+
+    def save(self, filename):
+        """
+        Writes the snapshot to a file that worker processes can
+        read with ``load_frozen``.
+
+        :param filename str: Where to write it.
+        """
+        with open(filename, "wb") as stream:
+            pickle.dump(self, stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+
 root = RootParameters()
 Parameters.root = root
 Parameters.manager = Manager(Parameters.root)
+Parameters.frozen = None
 
 
 def get_parameters(name=None, default_dict=None):
@@ -314,14 +401,170 @@ def get_parameters(name=None, default_dict=None):
         return root
 
 
-def add_arguments(parser):
+def _flatten(parameters):
+    names = set()
+    node = parameters
+    while node is not None:
+        names.update(node._items)
+        node = node.parent
+    resolved = dict()
+    for name in names:
+        try:
+            resolved[name] = parameters[name]
+        except KeyError:
+            pass  # A setting whose value is None.
+    return resolved
+
+
+def freeze():
+    """
+    Resolves every setting of every Parameters object into a
+    FrozenParameters snapshot. Call this after command-line and
+    settings files are applied, and hand the result to worker
+    processes, which call ``install``.
+
+    :return: A FrozenParameters.
+    """
+    resolved = {root.name: _flatten(root)}
+    for qualify, parameters in Parameters.manager.parameters_dict.items():
+        if isinstance(parameters, Parameters):
+            resolved[qualify] = _flatten(parameters)
+        else:
+            pass  # no parameters in PlaceHolder
+    return FrozenParameters(resolved)
+
+
+def install(frozen):
+    """
+    Makes every Parameters object answer from this snapshot before it
+    looks at its own settings or its parents. Parameters objects created
+    later, as modules are imported, answer from it too. Settings which
+    are not in the snapshot still resolve as usual.
+
+    :param frozen: A FrozenParameters, or None to remove a snapshot.
+    """
+    Parameters.frozen = frozen
+    _settings_changed()
+
+
+def load_frozen(filename):
+    """
+    Reads a snapshot written by ``FrozenParameters.save``. This is
+    a plain pickle load, so each process gets its own copy.
+
+    :param filename str: The file to read.
+    :return: A FrozenParameters.
+    """
+    with open(filename, "rb") as stream:
+        return pickle.load(stream)
+
+
+# The argparse type of a flag for each settings datatype, by class,
+# so flags can be made without resolving values. A bool has always
+# been an int flag, because resolved True is an int.
+_FLAG_TYPES = {datatypes.bool: int, datatypes.int: int,
+               datatypes.double: float, datatypes.string: str}
+_NO_FLAG = object()
+
+
+def _flag_type(raw):
+    """
+    The argparse type for a setting, from what was stored for it,
+    which is the same as the type of its resolved value. None means
+    a flag without a type, and _NO_FLAG means no flag at all.
+    """
+    if isinstance(raw, Setting):
+        if type(raw) in _FLAG_TYPES:
+            # A missing value doesn't resolve, so it gets a str flag.
+            return _FLAG_TYPES[type(raw)] if raw.value is not None else str
+        return None
+    elif isinstance(raw, int):
+        return int
+    elif isinstance(raw, float):
+        return float
+    elif isinstance(raw, str):
+        return str
+    elif isinstance(raw, (list, tuple, dict, set, frozenset)):
+        return _NO_FLAG
+    else:
+        return None
+
+
+def _flag_table():
+    """
+    Every settings flag and its argparse type, in the order they are
+    added. Each Parameters object gets a qualified flag for every name
+    it can see, from the nearest definition up its parents. Names
+    that only one Parameters object sees also get an unqualified flag.
+    This reads stored settings and resolves none of them.
+
+    :return: A list of (flag, type).
+    """
+    qualified = dict()
+    unqualified = dict()
+    non_unique = set()
+    for qualify, parameters in Parameters.manager.parameters_dict.items():
+        if not isinstance(parameters, Parameters):
+            continue  # no parameters in PlaceHolder
+        nearest = dict()
+        node = parameters
+        while node is not None:
+            for name, raw in node._items.items():
+                if name not in nearest:
+                    nearest[name] = raw
+            node = node.parent
+        for name, raw in nearest.items():
+            qualified["{}.{}".format(qualify, name)] = raw
+            if name in unqualified:
+                non_unique.add(name)
+            else:
+                unqualified[name] = raw
+
+    table = list()
+    for flags, raws in [(sorted(qualified), qualified),
+                        (sorted(set(unqualified) - non_unique), unqualified)]:
+        for flag in flags:
+            flag_type = _flag_type(raws[flag])
+            if flag_type is not _NO_FLAG:
+                table.append((flag, flag_type))
+    return table
+
+
+def _named_in(flags, argv, allow_abbrev):
+    """
+    The flags that these command-line arguments could name, counting
+    abbreviations if the parser allows them. None means all of them,
+    because someone asked for help.
+    """
+    names = sorted(flags)
+    wanted = set()
+    for argument in argv:
+        if argument == "-h":
+            return None
+        if not argument.startswith("--"):
+            continue
+        token = argument[2:].split("=", 1)[0]
+        if token and "help".startswith(token):
+            return None
+        if not allow_abbrev:
+            wanted.add(token)
+            continue
+        idx = bisect.bisect_left(names, token)
+        while idx < len(names) and names[idx].startswith(token):
+            wanted.add(names[idx])
+            idx += 1
+    return wanted
+
+
+def add_arguments(parser, argv=None):
     """
     Adds arguments to an argparse.ArgumentParser from settings files.
 
     Every setting in a settings file that is not a list or dictionary
     is turned into a fully-qualified name as a command-line flag.
     Those which are unique names are also turned into flags without
-    any qualification.
+    any qualification. Flag types come from the stored settings,
+    so no setting is resolved to make them.
 
     This also adds a --settings flag which can be used to read
     settings files, in order, first to last, all of which are
@@ -329,50 +572,27 @@ def add_arguments(parser):
     order those appear.
 
     :param parser: This is an argparse.ArgumentParser.
+    :param argv: The arguments that will be parsed. If given, only flags
+                 they name are added, unless they ask for help, so
+                 a program with thousands of settings starts quickly.
+                 Settings that aren't on the command line are None
+                 in the namespace either way.
     :return:
     """
     parser_group = parser.add_argument_group("settings")
-    # These map from the name to the default value.
-    qualified_parameters = dict()
-    unqualified_parameters = dict()
-    non_unique = set()
-
-    for qualify, parameters in Parameters.manager.parameters_dict.items():
-        if isinstance(parameters, Parameters):
-            for name in parameters:
-                try:
-                    value = parameters[name]
-                except KeyError:
-                    value = "None"
-                qualified_parameters["{}.{}".format(qualify, name)] = value
-                if name in unqualified_parameters:
-                    non_unique.add(name)
-                else:
-                    unqualified_parameters[name] = value
+    table = _flag_table()
+    if argv is not None:
+        wanted = _named_in([flag for (flag, _) in table], argv,
+                           getattr(parser, "allow_abbrev", True))
+        if wanted is not None:
+            table = [(flag, flag_type) for (flag, flag_type) in table
+                     if flag in wanted]
+
+    for flag, flag_type in table:
+        if flag_type is None:
+            parser_group.add_argument("--{}".format(flag))
         else:
-            pass  # no parameters in PlaceHolder
-
-    reel_out = collections.OrderedDict()
-    reel_out.update({k: qualified_parameters[k]
-                     for k in sorted(qualified_parameters)})
-    reel_out.update({k: unqualified_parameters[k]
-                     for k in sorted(set(unqualified_parameters)-non_unique)})
-
-    for flag, default in reel_out.items():
-        if isinstance(default, int):
-            parser_group.add_argument("--{}".format(flag), type=int)
-        elif isinstance(default, float):
-            parser_group.add_argument("--{}".format(flag), type=float)
-        elif isinstance(default, str):
-            parser_group.add_argument("--{}".format(flag), type=str)
-        elif isinstance(default, bool):
-            parser_group.add_argument("--{}".format(flag), type=bool)
-        elif isinstance(default, collections.Iterable):
-            pass
-        elif isinstance(default, collections.Mapping):
-            pass
-        else:
-            parser_group.add_argument("--{}".format(flag, type=str))
+            parser_group.add_argument("--{}".format(flag), type=flag_type)
 
 
 def namespace_settings(args):
@@ -383,15 +603,14 @@ def namespace_settings(args):
     :return:
     """
     logger.debug("settings sent to parameters {}".format(args))
+    _settings_changed()
     level = logging.INFO
     if "settings" in args.__dict__:
         if isinstance(args.settings, str):
-            with open(args.settings, "r") as settings_file:
-                read_json(settings_file)
+            read(args.settings)
         elif isinstance(args.settings, collections.Iterable):
             for fname in args.settings:
-                with open(fname, "r") as settings_file:
-                    read_json(settings_file)
+                read(fname)
         else:
             logger.error("Cannot interpret settings flag {}".format(
                 args.settings))
@@ -413,34 +632,98 @@ def namespace_settings(args):
 
         else:
             logger.debug("else flag {} value {}".format(flag, value))
-            unset = True
-            for q, parameters in Parameters.manager.parameters_dict.items():
-                if isinstance(parameters, Parameters):
-                    logger.debug("looking for {} in {}".format(flag, q))
-                    if flag in parameters._items:
-                        logger.debug("Setting {} to {} in {}".format(
-                            flag, value, q))
-                        parameters.update({flag: value})
-                        unset = False
-                else:
-                    pass  # no parameters in PlaceHolder
-            if unset:
-                pass  # Can we check whether this was a user-specified param?
+            for parameters in Parameters.manager.defined_by.get(flag, ()):
+                logger.debug("Setting {} to {} in {}".format(
+                    flag, value, parameters.name))
+                parameters.update({flag: value})
 
 
 def read(file_or_stream):
-    if issubclass(file_or_stream, str):
-        filename = file_or_stream
-        if filename.endswith(".yml"):
-            with open(filename, "r") as yaml_stream:
-                read_yaml(yaml_stream)
-        else:
-            with open(filename, "r") as json_stream:
-                read_jsonl(json_stream)
+    """
+    Reads settings from a filename, which is YAML if it ends in
+    ``.yml`` or ``.yaml`` and JSON otherwise, or from a JSON stream.
+    Files are parsed through ``load_settings``, so they are cached.
+    """
+    if isinstance(file_or_stream, str):
+        _apply_settings(load_settings(file_or_stream))
     else:
         read_json(file_or_stream)
 
 
+# Bump this when the layout of a settings cache file changes.
+_SETTINGS_CACHE_VERSION = 1
+
+
+def _settings_version(stat):
+    return (stat.st_size, getattr(stat, "st_mtime_ns", stat.st_mtime),
+            stat.st_ino)
+
+
+def _parse_settings(filename, text):
+    if filename.endswith((".yml", ".yaml")):
+        return yaml.load(text, Loader=_YamlLoader)
+    else:
+        return json.loads(text.decode("utf-8"))
+
+
+def load_settings(filename, cache=True):
+    """
+    Parses a settings file into a dictionary from module name to
+    settings, without applying it. The parse is kept as a pickle in
+    the provda cache. Another process that reads the same version of
+    the file, by its size, modification time, and inode, loads the
+    pickle without reading the file. If only the modification time
+    changed, the file's SHA-256 shows the pickle is still good.
+
+    :param filename str: A YAML file, ending in ``.yml`` or ``.yaml``,
+                         or a JSON file.
+    :param cache: Set False to parse the file and leave the cache alone.
+    :return: The parsed file.
+    """
+    stat = os.stat(filename)
+    version = _settings_version(stat)
+    cache_file = os.path.join(cache_dir(), "settings", "{}.pickle".format(
+        hashlib.sha1(os.path.realpath(filename).encode("utf-8")).hexdigest()))
+    cached = None
+    if cache:
+        try:
+            with open(cache_file, "rb") as stream:
+                cached = pickle.load(stream)
+            if cached[0] != _SETTINGS_CACHE_VERSION:
+                cached = None
+        except Exception:
+            cached = None  # Missing, partly written, or from another Python.
+        if cached is not None and cached[1] == version:
+            return cached[3]
+
+    with open(filename, "rb") as stream:
+        text = stream.read()
+    digest = hashlib.sha256(text).hexdigest()
+    if cached is not None and cached[2] == digest:
+        parsed = cached[3]
+    else:
+        parsed = _parse_settings(filename, text)
+    if cache:
+        try:
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            partial = "{}.{}".format(cache_file, os.getpid())
+            with open(partial, "wb") as stream:
+                pickle.dump((_SETTINGS_CACHE_VERSION, version, digest, parsed),
+                            stream, pickle.HIGHEST_PROTOCOL)
+            os.rename(partial, cache_file)
+        except (IOError, OSError):
+            pass  # Another process wrote it, or there is no place to cache.
+    return parsed
+
+
+def _apply_settings(per_module_settings):
+    logger.debug(per_module_settings)
+    _settings_changed()
+    for (namespace, settings) in per_module_settings.items():
+        get_parameters(namespace).update(settings)
+
+
 # Loading settings
 def read_yaml(stream):
     """
@@ -450,10 +733,7 @@ def read_yaml(stream):
     :param stream: A Python stream object, that is, ``f=open(filename, "r").``
     :return: None
     """
-    per_module_settings = yaml.load(stream)
-    logger.debug(per_module_settings)
-    for (namespace, settings) in per_module_settings.items():
-        get_parameters(namespace).update(settings)
+    _apply_settings(yaml.load(stream, Loader=_YamlLoader))
 
 
 # Loading settings
@@ -465,10 +745,7 @@ def read_json(stream):
     :param stream: A Python stream object, that is, ``f=open(filename, "r").``
     :return: None
     """
-    per_module_settings = json.load(stream)
-    logger.debug(per_module_settings)
-    for (namespace, settings) in per_module_settings.items():
-        get_parameters(namespace).update(settings)
+    _apply_settings(json.load(stream))
 
 
 # Threading to protect global hierarchy of parameters.
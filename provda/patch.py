@@ -1,15 +1,17 @@
 """
 Wraps modules in order to call logging methods for provenance.
-Must be loaded after the modules it wraps. Chose this order because
-numpy will always be loaded before a random package like provda.
-Could add a loader, as in recipy, to hook things that are loaded after.
+Modules that are already loaded are wrapped when this is imported.
+Modules that are loaded later are wrapped as they are imported,
+by a finder on ``sys.meta_path``, as in recipy.
 """
 try:
     import builtins
 except ImportError:
     import __builtin__ as builtins
+import importlib.abc
 import logging
 import sys
+from time import perf_counter
 import wrapt
 from . import logprov  # This hooks logging, so it only looks unused.
 
@@ -17,69 +19,463 @@ from . import logprov  # This hooks logging, so it only looks unused.
 logger = logging.getLogger("provda.patch")
 
 
+def _is_path(path):
+    return isinstance(path, (str, bytes)) or hasattr(path, "__fspath__")
+
+
+def _timed_read(path, wrapped, args, kwargs):
+    """
+    Calls a function that reads a file and reports the read with
+    the seconds the call took. It reports even if the call fails,
+    as for a missing file. The document that records it finds the
+    bytes from the file's size, later, so the call doesn't wait on stat.
+    """
+    start = perf_counter()
+    try:
+        return wrapped(*args, **kwargs)
+    finally:
+        logger.read_file(path, "unknown", duration=perf_counter() - start)
+
+
+def _timed_write(path, wrapped, args, kwargs):
+    start = perf_counter()
+    try:
+        return wrapped(*args, **kwargs)
+    finally:
+        logger.write_file(path, "unknown", duration=perf_counter() - start)
+
+
 @wrapt.decorator
 def report_write(wrapped, instance, args, kwargs):
-    logger.write_file(args[0], "unknown")
+    if args:
+        return _timed_write(args[0], wrapped, args, kwargs)
     return wrapped(*args, **kwargs)
 
 
 @wrapt.decorator
 def report_read(wrapped, instance, args, kwargs):
-    logger.read_file(args[0], "unknown")
+    if args:
+        return _timed_read(args[0], wrapped, args, kwargs)
     return wrapped(*args, **kwargs)
 
 
+@wrapt.decorator
+def report_copy(wrapped, instance, args, kwargs):
+    if len(args) < 2:
+        return wrapped(*args, **kwargs)
+    start = perf_counter()
+    try:
+        return wrapped(*args, **kwargs)
+    finally:
+        duration = perf_counter() - start
+        logger.read_file(args[0], "unknown", duration=duration)
+        logger.write_file(args[1], "unknown", duration=duration)
+
+
+def _argument(args, kwargs, position, keyword):
+    if keyword is not None and keyword in kwargs:
+        return kwargs[keyword]
+    elif position < len(args):
+        return args[position]
+    else:
+        return None
+
+
+def report_read_at(position, keyword=None):
+    """
+    Makes a wrapper that reports a read of the file named by
+    the argument at this position or with this keyword.
+    """
+    @wrapt.decorator
+    def report(wrapped, instance, args, kwargs):
+        path = _argument(args, kwargs, position, keyword)
+        if path is not None:
+            return _timed_read(path, wrapped, args, kwargs)
+        return wrapped(*args, **kwargs)
+    return report
+
+
+def report_write_at(position, keyword=None):
+    """
+    Makes a wrapper that reports a write of the file named by
+    the argument at this position or with this keyword.
+    """
+    @wrapt.decorator
+    def report(wrapped, instance, args, kwargs):
+        path = _argument(args, kwargs, position, keyword)
+        if path is not None:
+            return _timed_write(path, wrapped, args, kwargs)
+        return wrapped(*args, **kwargs)
+    return report
+
+
+def report_open(default_mode="r"):
+    """
+    Makes a wrapper for calls that open a file, or constructors
+    of file objects, which take a path and then a mode,
+    such as ``h5py.File.__init__``. The time reported is the
+    time to open.
+    """
+    @wrapt.decorator
+    def report(wrapped, instance, args, kwargs):
+        path = _argument(args, kwargs, 0, None)
+        # Libraries reopen their own handles, as h5py does with a FileID.
+        if not _is_path(path):
+            return wrapped(*args, **kwargs)
+        mode = _argument(args, kwargs, 1, "mode") or default_mode
+        start = perf_counter()
+        try:
+            return wrapped(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            if "r" in mode:
+                logger.read_file(path, "unknown", duration=duration)
+            if _writes(mode):
+                logger.write_file(path, "unknown", duration=duration)
+    return report
+
+
+def _writes(mode):
+    return bool({"w", "x", "a", "+"} & set(mode))
+
+
+# Each module lists functions and methods that read ("in"), write ("out"),
+# open with a mode ("open"), or copy from a first to a second path ("copy").
+# An "in" or "out" entry is a name, if the path is always the first
+# argument, or (name, position, keyword) if it can be passed by keyword
+# or comes later. An "open" entry is a name, if the default mode is "r",
+# or (name, default mode).
+# Use ``register`` to add to these.
 WRAPS0 = {
     "pandas": {
         "in": [
-            "read_csv", "read_table", "read_excel", "read_hdf",
-            "read_pickle", "read_stata", "read_msgpack"
+            ("read_csv", 0, "filepath_or_buffer"),
+            ("read_table", 0, "filepath_or_buffer"),
+            ("read_excel", 0, "io"), ("read_hdf", 0, "path_or_buf"),
+            ("read_pickle", 0, "filepath_or_buffer"),
+            ("read_stata", 0, "filepath_or_buffer"),
+            ("read_msgpack", 0, "path_or_buf"), ("read_parquet", 0, "path"),
+            ("read_feather", 0, "path")
         ],
         "out": [
-            'DataFrame.to_csv', 'DataFrame.to_excel', 'DataFrame.to_hdf',
-            'DataFrame.to_msgpack', 'DataFrame.to_stata',
-            'DataFrame.to_pickle', 'Panel.to_excel', 'Panel.to_hdf',
-            'Panel.to_msgpack', 'Panel.to_pickle',
-            'Series.to_csv', 'Series.to_hdf',
-            'Series.to_msgpack', 'Series.to_pickle'
+            ("DataFrame.to_csv", 0, "path_or_buf"),
+            ("DataFrame.to_excel", 0, "excel_writer"),
+            ("DataFrame.to_hdf", 0, "path_or_buf"),
+            ("DataFrame.to_msgpack", 0, "path_or_buf"),
+            ("DataFrame.to_stata", 0, "path"),
+            ("DataFrame.to_pickle", 0, "path"),
+            ("DataFrame.to_parquet", 0, "path"),
+            ("DataFrame.to_feather", 0, "path"),
+            ("Panel.to_excel", 0, "path"), ("Panel.to_hdf", 0, "path_or_buf"),
+            ("Panel.to_msgpack", 0, "path_or_buf"),
+            ("Panel.to_pickle", 0, "path"),
+            ("Series.to_csv", 0, "path_or_buf"),
+            ("Series.to_hdf", 0, "path_or_buf"),
+            ("Series.to_msgpack", 0, "path_or_buf"),
+            ("Series.to_pickle", 0, "path")
         ]
     },
     "matplotlib.pyplot": {
         "in": [],
         "out": [
-            "savefig"
+            ("savefig", 0, "fname")
         ]
     },
     "numpy": {
         "in": [
-            'genfromtxt', 'loadtxt', 'fromfile'
+            ("genfromtxt", 0, "fname"), ("loadtxt", 0, "fname"),
+            ("fromfile", 0, "file")
         ],
         "out": [
-            'save', 'savez', 'savez_compressed', 'savetxt'
+            ("save", 0, "file"), ("savez", 0, "file"),
+            ("savez_compressed", 0, "file"), ("savetxt", 0, "fname")
         ]
+    },
+    "h5py": {
+        "open": ["File.__init__"]
+    },
+    "pyarrow.parquet": {
+        "in": [
+            ("read_table", 0, "source"), ("read_pandas", 0, "source"),
+            ("ParquetFile.__init__", 0, "source")
+        ],
+        "out": [("write_table", 1, "where")]
+    },
+    "pyarrow.feather": {
+        "in": [("read_feather", 0, "source"), ("read_table", 0, "source")],
+        "out": [("write_feather", 1, "dest")]
+    },
+    "xarray": {
+        "in": [
+            ("open_dataset", 0, "filename_or_obj"),
+            ("open_dataarray", 0, "filename_or_obj"),
+            ("open_zarr", 0, "store"),
+            ("load_dataset", 0, "filename_or_obj"),
+            ("load_dataarray", 0, "filename_or_obj")
+        ],
+        "out": [
+            ("Dataset.to_netcdf", 0, "path"), ("Dataset.to_zarr", 0, "store"),
+            ("DataArray.to_netcdf", 0, "path")
+        ]
+    },
+    "shutil": {
+        # copy and copy2 call copyfile with the destination file's path.
+        "copy": ["copyfile", "move"]
     }
 }
 
 
+def register(module_name, reads=(), writes=(), opens=(), copies=()):
+    """
+    Adds functions or methods of a module to those that report
+    provenance, with entries as described for WRAPS0. If the module
+    is loaded, they are wrapped now. Otherwise they are wrapped
+    when it is imported.
+
+    :param module_name: Such as "netCDF4".
+    :param reads: Entries for functions that read a file.
+    :param writes: Entries for functions that write a file.
+    :param opens: Entries for functions that open a file with a mode.
+    :param copies: Names of functions that copy a file to a file.
+    """
+    in_out = WRAPS0.setdefault(module_name, dict())
+    for kind, entries in [("in", reads), ("out", writes), ("open", opens),
+                          ("copy", copies)]:
+        in_out.setdefault(kind, list()).extend(entries)
+    if module_name in sys.modules:
+        wrap_module(sys.modules[module_name])
+
+
+def _wrappers(in_out):
+    """
+    Turns the entries for one module into (name, wrapper) pairs.
+    """
+    for entry in in_out.get("in", []):
+        if isinstance(entry, str):
+            yield entry, report_read
+        else:
+            yield entry[0], report_read_at(*entry[1:])
+    for entry in in_out.get("out", []):
+        if isinstance(entry, str):
+            yield entry, report_write
+        else:
+            yield entry[0], report_write_at(*entry[1:])
+    for entry in in_out.get("open", []):
+        if isinstance(entry, str):
+            yield entry, report_open()
+        else:
+            yield entry[0], report_open(*entry[1:])
+    for entry in in_out.get("copy", []):
+        yield entry, report_copy
+
+
+def _wrap_attribute(module, dotted, wrapper):
+    """
+    Wraps module.dotted, where dotted may name a method,
+    such as "DataFrame.to_csv". Skips names this version
+    of the module doesn't have.
+    """
+    owner = module
+    names = dotted.split(".")
+    try:
+        for name in names[:-1]:
+            owner = getattr(owner, name)
+        setattr(owner, names[-1], wrapper(getattr(owner, names[-1])))
+    except AttributeError:
+        logger.debug("{} has no {}".format(module.__name__, dotted))
+
+
+def wrap_module(module):
+    """
+    Wraps the reading and writing functions of one module listed
+    in WRAPS0. Each is wrapped once, however often this is called.
+
+    :param module: The module object.
+    """
+    wrapped = getattr(module, "_provda_patch", None)
+    if not isinstance(wrapped, set):
+        wrapped = set()
+        module._provda_patch = wrapped
+    for name, wrapper in _wrappers(WRAPS0[module.__name__]):
+        if name not in wrapped:
+            _wrap_attribute(module, name, wrapper)
+            wrapped.add(name)
+
+
 def wrap_modules():
-    for module_name, in_out in WRAPS0.items():
+    for module_name in list(WRAPS0.keys()):
         if module_name in sys.modules:
-            module = sys.modules[module_name]
-            if not hasattr(module, "_provda_patch"):
-                for in_f in in_out["in"]:
-                    setattr(module, in_f, report_read(getattr(module, in_f)))
-                for o_f in in_out["out"]:
-                    setattr(module, o_f, report_write(getattr(module, o_f)))
-                module._provda_patch = True
+            wrap_module(sys.modules[module_name])
+
+
+class _WrapLoader(importlib.abc.Loader):
+    """
+    Runs a module's own loader, then wraps the module.
+    """
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Put the real loader back so resource lookups find it.
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        wrap_module(module)
+
+
+class WrapFinder(importlib.abc.MetaPathFinder):
+    """
+    Finds modules listed in WRAPS0 with the finders after it on
+    sys.meta_path and arranges for them to be wrapped when loaded.
+    """
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in WRAPS0:
+            return None
+        finders = sys.meta_path
+        for finder in finders[finders.index(self) + 1:]:
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, "exec_module"):
+                    spec.loader = _WrapLoader(spec.loader)
+                return spec
+        return None
+
+
+def install_import_hook():
+    """
+    Wraps modules in WRAPS0 that are imported from now on.
+    """
+    if not any(isinstance(f, WrapFinder) for f in sys.meta_path):
+        sys.meta_path.insert(0, WrapFinder())
 
 
 wrap_modules()
+install_import_hook()
+
+
+class _CountingFile(object):
+    """
+    A file object that counts the bytes and the seconds spent in its
+    reads and writes, and reports them when it is closed. A text file
+    counts characters, so it reports only seconds, and the document
+    takes the bytes from the file's size. Everything else goes straight to the file.
+    This isn't a wrapt.ObjectProxy because looking up the proxy's own
+    attributes through one would cost more than the read it counts.
+    """
+    __slots__ = ("_file", "_path", "_mode", "_read", "_written",
+                 "_reported", "_raw_read", "_raw_write")
+
+    def __init__(self, wrapped, path, mode):
+        self._file = wrapped
+        self._path = path
+        self._mode = mode
+        # [bytes, seconds]
+        self._read = [0, 0.0]
+        self._written = [0, 0.0]
+        self._reported = False
+        self._raw_read = getattr(wrapped, "read", None)
+        self._raw_write = getattr(wrapped, "write", None)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def _reading(self, data, start):
+        counts = self._read
+        counts[1] += perf_counter() - start
+        counts[0] += len(data)
+        return data
+
+    def read(self, *args):
+        start = perf_counter()
+        data = self._raw_read(*args)
+        counts = self._read
+        counts[1] += perf_counter() - start
+        counts[0] += len(data)
+        return data
+
+    def readline(self, *args):
+        start = perf_counter()
+        return self._reading(self._file.readline(*args), start)
+
+    def readlines(self, *args):
+        start = perf_counter()
+        lines = self._file.readlines(*args)
+        self._read[1] += perf_counter() - start
+        self._read[0] += sum(len(line) for line in lines)
+        return lines
+
+    def readinto(self, buffer):
+        start = perf_counter()
+        count = self._file.readinto(buffer)
+        self._read[1] += perf_counter() - start
+        self._read[0] += count or 0
+        return count
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = perf_counter()
+        return self._reading(next(self._file), start)
+
+    def write(self, data):
+        start = perf_counter()
+        count = self._raw_write(data)
+        counts = self._written
+        counts[1] += perf_counter() - start
+        counts[0] += count if count is not None else len(data)
+        return count
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._report()
+
+    def __enter__(self):
+        self._file.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self._report()
+
+    def _report(self):
+        if self._reported:
+            return
+        self._reported = True
+        binary = "b" in self._mode
+        if "r" in self._mode:
+            logger.read_file(self._path, "unknown",
+                             bytes=self._read[0] if binary else None,
+                             duration=self._read[1])
+        if _writes(self._mode):
+            logger.write_file(self._path, "unknown",
+                              bytes=self._written[0] if binary else None,
+                              duration=self._written[1])
 
 
 def open(*args, **kwargs):
     """All good ideas from https://github.com/recipy:
     Use this as provda.patch.open(file, mode="blah").
     We don't want to hook open because lots of other modules use it.
+
+    The file it returns counts bytes and time spent reading and
+    writing, and reports them when it is closed. A file that
+    can't be opened is reported at once.
     """
     if "mode" in kwargs:
         mode = kwargs["mode"]
@@ -87,10 +483,14 @@ def open(*args, **kwargs):
         mode = args[1]
     else:
         mode = "r"
-
-    if "r" in mode:
-        logger.read_file(args[0], "unknown")
-    if {"w", "x", "a", "+"} & set(mode):
-        logger.write_file(args[0], "unknown")
-
-    return builtins.open(*args, **kwargs)
+    start = perf_counter()
+    try:
+        opened = builtins.open(*args, **kwargs)
+    except (IOError, OSError):
+        duration = perf_counter() - start
+        if "r" in mode:
+            logger.read_file(args[0], "unknown", duration=duration)
+        if _writes(mode):
+            logger.write_file(args[0], "unknown", duration=duration)
+        raise
+    return _CountingFile(opened, args[0], mode)
@@ -1,38 +1,402 @@
 import collections
 import logging
+import multiprocessing
 import os
+import re
 import shutil
 import tempfile
-from PyPDF2 import PdfFileWriter, PdfFileReader
+import time
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+    _LEGACY = False
+except ImportError:  # PyPDF2 before 1.28 has only the camelCase names.
+    from PyPDF2 import PdfFileReader as PdfReader, \
+        PdfFileWriter as PdfWriter
+    _LEGACY = True
 
 
 logger = logging.getLogger("provda.pdf")
 
 
-def add_keys(pdf_file, kv):
+def add_keys(pdf_file, kv, incremental=True):
     """
     Add a dictionary of key-value pairs to a pdf file.
     Adds metadata to PDF files so you can know how they were generated.
 
+    By default, this appends a new Info dictionary to the end of the
+    file as a PDF incremental update, so the cost is in the size of
+    the metadata, not the document. Files that can't be updated that
+    way, because they use cross-reference streams, are rewritten.
+    Encrypted files are left as they are, with a ValueError, because
+    rewriting them would drop their passwords and permissions.
+
     :param pdf_file: Either an iterable of files or a filename.
     :param kv: A readable mapping (dict).
+    :param incremental: Set False to always rewrite the file.
     """
-    try:
-        pdf_file = iter(pdf_file)
-    except TypeError:
+    if isinstance(pdf_file, str):
         pdf_file = [pdf_file]
-    assert isinstance(keydict, collections.Mapping)
+    assert isinstance(kv, collections.Mapping)
 
     for orig in pdf_file:
         logger.debug("Adding keys to {}".format(orig))
+        if incremental:
+            try:
+                _append_info(orig, kv)
+                continue
+            except NotIncremental as err:
+                logger.debug("Rewriting {}: {}".format(orig, err))
+        _rewrite(orig, kv)
+
+
+def _rewrite(orig, kv):
+    """
+    Writes the pages and Info of the file, with these keys, to a new
+    file, and copies it over the old one.
+    """
+    pdfDict = dict()
+    with open(orig, "rb") as in_stream:
+        in_file = PdfReader(in_stream)
+        out_obj = PdfWriter()
+        if _LEGACY:
+            encrypted = in_file.isEncrypted
+            add_page, add_metadata = out_obj.addPage, out_obj.addMetadata
+        else:
+            encrypted = in_file.is_encrypted
+            add_page, add_metadata = out_obj.add_page, out_obj.add_metadata
+        if encrypted:
+            # PyPDF2 can't write it back with the owner's password.
+            raise ValueError("{} is encrypted, so it is left as it is".format(
+                orig))
+        if _LEGACY:
+            old_info = in_file.getDocumentInfo()
+        else:
+            old_info = in_file.metadata
+        pdfDict.update({k: str(v) for (k, v) in (old_info or {}).items()})
+        pdfDict.update({u"/{0}".format(k): str(v) for (k, v) in kv.items()})
+        for page in in_file.pages:
+            add_page(page)
+        add_metadata(pdfDict)
         out_file = tempfile.NamedTemporaryFile(mode="wb", delete=False)
-        pdfDict = {u"/{0}".format(k): v for (k, v) in kv.items()}
-        in_file = PdfFileReader(orig)
-        out_obj = PdfFileWriter()
-        out_obj.addMetadata(pdfDict)
-        for page in range(in_file.getNumPages()):
-            out_obj.addPage(in_file.getPage(page))
-        out_obj.write(out_file)
-        out_file.close()
-        shutil.copy(out_file.name, orig)
-        os.remove(out_file)
+        try:
+            out_obj.write(out_file)
+        finally:
+            out_file.close()
+    shutil.copy(out_file.name, orig)
+    os.remove(out_file.name)
+
+
+def _timed_add_keys(pdf_file_kv):
+    pdf_file, kv = pdf_file_kv
+    start = time.time()
+    try:
+        add_keys(pdf_file, kv)
+        error = None
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return pdf_file, time.time() - start, error
+
+
+def add_keys_many(pdf_files, kv, processes=None):
+    """
+    Adds the same key-value pairs to many PDF files, using a pool of
+    processes. A file that fails doesn't stop the rest.
+
+    :param pdf_files: An iterable of filenames.
+    :param kv: A readable mapping (dict).
+    :param processes: How many processes. Defaults to the number of cores.
+    :return: A list of (filename, seconds, error) in the order given,
+             where error is None or a description of what failed.
+    """
+    work = [(pdf_file, dict(kv)) for pdf_file in pdf_files]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_timed_add_keys, work)
+    finally:
+        pool.close()
+        pool.join()
+    for filename, seconds, error in results:
+        if error is not None:
+            logger.error("Could not add keys to {}: {}".format(
+                filename, error))
+        else:
+            logger.debug("Added keys to {} in {:.3f}s".format(
+                filename, seconds))
+    return results
+
+
+class NotIncremental(Exception):
+    """
+    This file can't take an incremental update from this module.
+    """
+    pass
+
+
+# How far from the end of the file to look for startxref.
+_TAIL = 2048
+_REFERENCE = re.compile(br"(\d+)\s+(\d+)\s+R")
+# A cross-reference entry: offset, generation, in use or free, and
+# a two-byte end of line.
+_ENTRY = re.compile(br"(\d{10}) (\d{5}) ([nf])(?: \r| \n|\r\n)$")
+_DELIMITERS = b"()<>[]{}/%"
+_WHITESPACE = b"\x00\t\n\x0c\r "
+
+
+def _append_info(filename, kv):
+    """
+    Appends an Info dictionary that has the old entries and these
+    keys, a cross-reference section for it, and a trailer.
+    """
+    with open(filename, "r+b") as stream:
+        try:
+            prepared = _prepare_info(stream, kv)
+        except (IndexError, ValueError, AttributeError) as err:
+            # Nothing is written until the old file has parsed.
+            raise NotIncremental("can't parse: {}".format(err))
+        _write_info(stream, *prepared)
+
+
+def _prepare_info(stream, kv):
+    """
+    Reads what the update needs from the end of the file.
+    """
+    stream.seek(0, os.SEEK_END)
+    end = stream.tell()
+    stream.seek(max(0, end - _TAIL))
+    tail = stream.read()
+    found = tail.rfind(b"startxref")
+    if found < 0:
+        raise NotIncremental("no startxref")
+    prev = int(tail[found + len(b"startxref"):].split()[0])
+    trailer = _read_trailer(stream, prev)
+    if b"/Encrypt" in trailer or b"/Root" not in trailer:
+        raise NotIncremental("encrypted or has no root")
+    if b"/XRefStm" in trailer:
+        # Objects, maybe the Info, can be in a stream this doesn't read.
+        raise NotIncremental("hybrid cross-reference")
+
+    entries = collections.OrderedDict()
+    info = _REFERENCE.search(trailer.split(b"/Info", 1)[1]) \
+        if b"/Info" in trailer else None
+    if info is not None:
+        offset = _find_object(stream, prev, int(info.group(1)))
+        if offset is None:
+            # Replacing an Info that can't be read would lose its entries.
+            raise NotIncremental("can't find the Info object")
+        entries.update(_info_entries(stream, offset))
+    for k, v in kv.items():
+        entries[_name(k)] = _literal(v)
+
+    size = int(re.search(br"/Size\s+(\d+)", trailer).group(1))
+    root = _REFERENCE.search(trailer.split(b"/Root", 1)[1]).group(0)
+    document_id = re.search(br"/ID\s*(\[[^\]]*\])", trailer)
+    return end, tail, prev, entries, size, root, document_id
+
+
+def _write_info(stream, end, tail, prev, entries, size, root, document_id):
+    """
+    Appends the Info object, its cross-reference section, and a trailer
+    that points back to the previous one.
+    """
+    stream.seek(end)
+    if not tail.endswith(b"\n"):
+        stream.write(b"\n")
+    info_offset = stream.tell()
+    body = b"".join(b" " + k + b" " + v for (k, v) in entries.items())
+    stream.write("{} 0 obj\n<<".format(size).encode("ascii") +
+                 body + b" >>\nendobj\n")
+    xref_offset = stream.tell()
+    parts = [
+        "xref\n0 1\n0000000000 65535 f \n{} 1\n{:010d} 00000 n \n".format(
+            size, info_offset).encode("ascii"),
+        "trailer\n<< /Size {} /Root ".format(size + 1).encode("ascii"),
+        root,
+        " /Info {} 0 R /Prev {}".format(size, prev).encode("ascii"),
+    ]
+    if document_id is not None:
+        parts.append(b" /ID " + document_id.group(1))
+    parts.append(" >>\nstartxref\n{}\n%%EOF\n".format(
+        xref_offset).encode("ascii"))
+    stream.write(b"".join(parts))
+
+
+def _read_xref(stream, xref_offset, number=None):
+    """
+    Reads the classic cross-reference section at this offset, seeking
+    past its entries, which are exactly twenty bytes each. An entry
+    that isn't, or a section that doesn't parse, raises NotIncremental.
+
+    :return: The offset of object ``number``, if this section has it,
+             and the bytes of the section's trailer dictionary.
+    """
+    stream.seek(xref_offset)
+    if not stream.readline().strip() == b"xref":
+        raise NotIncremental("cross-reference stream")
+    found = None
+    while True:
+        line_start = stream.tell()
+        line = stream.readline()
+        fields = line.split()
+        if not fields and line:
+            continue
+        if len(fields) != 2 or not fields[0].isdigit():
+            break
+        if not fields[1].isdigit():
+            raise NotIncremental("bad subsection {!r}".format(line))
+        first, count = int(fields[0]), int(fields[1])
+        if number is not None and first <= number < first + count:
+            here = stream.tell()
+            stream.seek(here + (number - first) * 20)
+            entry = _ENTRY.match(stream.read(20))
+            if entry is None:
+                raise NotIncremental("bad entry for object {}".format(
+                    number))
+            if entry.group(3) == b"n":
+                found = int(entry.group(1))
+            number = None
+            stream.seek(here)
+        stream.seek(count * 20, os.SEEK_CUR)
+    if not fields or not fields[0].startswith(b"trailer"):
+        raise NotIncremental("no trailer")
+    stream.seek(line_start)
+    text = stream.read(64 * 1024)
+    start = text.find(b"<<")
+    if start < 0:
+        raise NotIncremental("no trailer dictionary")
+    return found, text[start:start + _balanced_dictionary(text, start)]
+
+
+def _read_trailer(stream, xref_offset):
+    return _read_xref(stream, xref_offset)[1]
+
+
+def _find_object(stream, xref_offset, number):
+    """
+    Offset of an object, following the chain of cross-reference
+    sections back from the newest.
+    """
+    while xref_offset is not None:
+        found, trailer = _read_xref(stream, xref_offset, number)
+        if found is not None:
+            return found
+        previous = re.search(br"/Prev\s+(\d+)", trailer)
+        xref_offset = int(previous.group(1)) if previous else None
+    return None
+
+
+def _info_entries(stream, offset):
+    stream.seek(offset)
+    text = stream.read(64 * 1024)
+    start = text.index(b"<<")
+    length = _balanced_dictionary(text, start)
+    body = text[start + 2:start + length - 2]
+    entries = collections.OrderedDict()
+    position = 0
+    while True:
+        position = _skip_whitespace(body, position)
+        if position >= len(body):
+            break
+        key_end = _token_end(body, position + 1)
+        key = body[position:key_end]
+        value_start = _skip_whitespace(body, key_end)
+        value_end = _object_end(body, value_start)
+        entries[key] = body[value_start:value_end]
+        position = value_end
+    return entries
+
+
+def _skip_whitespace(text, position):
+    while position < len(text) and text[position:position + 1] in \
+            _WHITESPACE:
+        position += 1
+    return position
+
+
+def _token_end(text, position):
+    while position < len(text) and \
+            text[position:position + 1] not in _WHITESPACE + _DELIMITERS:
+        position += 1
+    return position
+
+
+def _object_end(text, position):
+    """
+    Where the PDF object that starts at this position ends.
+    """
+    first = text[position:position + 1]
+    if text[position:position + 2] == b"<<":
+        return position + _balanced_dictionary(text, position)
+    elif first == b"(":
+        depth = 0
+        while True:
+            c = text[position:position + 1]
+            if not c:
+                raise NotIncremental("unterminated string")
+            if c == b"\\":
+                position += 2
+                continue
+            if c == b"(":
+                depth += 1
+            elif c == b")":
+                depth -= 1
+            position += 1
+            if depth == 0:
+                return position
+    elif first == b"<":
+        return text.index(b">", position) + 1
+    elif first == b"[":
+        position += 1
+        while True:
+            position = _skip_whitespace(text, position)
+            if text[position:position + 1] == b"]":
+                return position + 1
+            position = _next_object(text, position)
+    elif first == b"/":
+        return _token_end(text, position + 1)
+    else:
+        reference = _REFERENCE.match(text, position)
+        if reference is not None:
+            return reference.end()
+        return _token_end(text, position)
+
+
+def _balanced_dictionary(text, start):
+    """
+    Length of the dictionary that starts at text[start] with "<<".
+    """
+    position = start + 2
+    while True:
+        position = _skip_whitespace(text, position)
+        if text[position:position + 2] == b">>":
+            return position + 2 - start
+        position = _next_object(text, position)
+
+
+def _next_object(text, position):
+    end = _object_end(text, position)
+    if end <= position or end > len(text):
+        raise NotIncremental("can't read object at {}".format(position))
+    return end
+
+
+def _name(key):
+    encoded = list()
+    for c in str(key).encode("utf-8"):
+        char = bytes([c])
+        if 33 <= c <= 126 and char not in _DELIMITERS + b"#":
+            encoded.append(char)
+        else:
+            encoded.append("#{:02X}".format(c).encode("ascii"))
+    return b"/" + b"".join(encoded)
+
+
+def _literal(value):
+    text = str(value)
+    try:
+        raw = text.encode("latin-1")
+    except UnicodeEncodeError:
+        # A text string outside PDFDocEncoding is UTF-16 with a BOM.
+        raw = b"\xfe\xff" + text.encode("utf-16-be")
+    escaped = raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(
+        b")", b"\\)").replace(b"\r", b"\\r")
+    return b"(" + escaped + b")"
@@ -0,0 +1,188 @@
+"""
+Keeps provenance for files beside them, in a store of its own,
+so any file type gets provenance without being rewritten.
+
+The store is a directory of small JSON files. Each file's provenance
+is filed under its path, and the SHA-256 of its contents points back
+to every path that had those contents, because two files with the
+same bytes can come from different jobs. Finding provenance by path
+opens one file whose name is computed, and by hash lists one small
+directory::
+
+    store/path/8c41...07.json                {"path": ..., "sha256": ...,
+                                              "provenance": ...}
+    store/hash/3f/3f9a...e1/8c41...07.json   {"path": ...}
+
+Every write goes to a temporary file that is renamed into place,
+so readers never see half a record, and many tasks can share a store.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+from .cache import cache_dir
+from .digest import file_digest
+
+
+logger = logging.getLogger("provda.sidecar")
+
+
+def default_directory():
+    """
+    The store that ``provda.add_provenance`` uses, which is the
+    PROVDA_SIDECAR environment variable, if set, or a directory
+    in the provda cache.
+    """
+    return os.environ.get("PROVDA_SIDECAR",
+                          os.path.join(cache_dir(), "sidecar"))
+
+
+class SidecarStore(object):
+    """
+    A directory that maps files, by path and by content hash,
+    to the provenance of what made them.
+    """
+    def __init__(self, directory):
+        """
+        :param directory: Where the store is. It is created when
+                          the first record is written.
+        """
+        self.directory = directory
+
+    def _hash_directory(self, sha256):
+        return os.path.join(self.directory, "hash", sha256[:2], sha256)
+
+    def _path_key(self, path):
+        return hashlib.sha1(
+            os.path.realpath(path).encode("utf-8")).hexdigest() + ".json"
+
+    def _path_file(self, path):
+        return os.path.join(self.directory, "path", self._path_key(path))
+
+    def put(self, path, provenance, sha256=None):
+        """
+        Records the provenance of a file.
+
+        :param path: The file, which must exist.
+        :param provenance: A mapping that can be written as JSON, or
+                           a ProcessDocument, which is stored as PROV-JSON.
+        :param sha256: The content hash, if the caller has it already.
+        :return: The content hash.
+        """
+        if hasattr(provenance, "as_dict"):
+            provenance = provenance.as_dict()
+        stat = os.stat(path)
+        if sha256 is None:
+            sha256 = file_digest(path)
+        real_path = os.path.realpath(path)
+        _write_json(self._path_file(path), {
+            "path": real_path,
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "provenance": provenance
+        })
+        _write_json(os.path.join(self._hash_directory(sha256),
+                                 self._path_key(path)), {"path": real_path})
+        logger.debug("Stored provenance for {} as {}".format(path, sha256))
+        return sha256
+
+    def records_by_hash(self, sha256):
+        """
+        Provenance for every file recorded with these contents,
+        most recently recorded first.
+
+        :param sha256: The hex SHA-256 of the contents.
+        :return: A list of records, as from ``by_path``.
+        """
+        directory = self._hash_directory(sha256)
+        try:
+            pointers = os.listdir(directory)
+        except OSError:
+            return list()
+        records = list()
+        for name in pointers:
+            pointer = _read_json(os.path.join(directory, name))
+            if pointer is None:
+                continue
+            record = _read_json(self._path_file(pointer["path"]))
+            # The path may since have been recorded with other contents.
+            if record is not None and record["sha256"] == sha256:
+                records.append(record)
+        records.sort(key=lambda record: record["mtime"], reverse=True)
+        return records
+
+    def by_hash(self, sha256):
+        """
+        Provenance for a file with these contents, the most recently
+        recorded one if many files have them.
+
+        :param sha256: The hex SHA-256 of the contents.
+        :return: The record, as from ``by_path``, or None.
+        """
+        records = self.records_by_hash(sha256)
+        return records[0] if records else None
+
+    def by_path(self, path, check=True):
+        """
+        Provenance for the file at this path.
+
+        :param path: The file.
+        :param check: If the file's size or modification time changed
+                      since it was recorded, its contents may not be what
+                      the provenance describes, so return None. Set False
+                      to return the last record anyway.
+        :return: The record, with "path", "sha256", "size", "mtime",
+                 and "provenance", or None.
+        """
+        record = _read_json(self._path_file(path))
+        if record is None:
+            return None
+        if check:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if (stat.st_size, stat.st_mtime) != \
+                    (record["size"], record["mtime"]):
+                logger.debug("{} changed since it was recorded".format(path))
+                return None
+        return record
+
+    def remove(self, path):
+        """
+        Forgets the path and its provenance.
+        """
+        record = _read_json(self._path_file(path))
+        filenames = [self._path_file(path)]
+        if record is not None:
+            filenames.append(os.path.join(
+                self._hash_directory(record["sha256"]), self._path_key(path)))
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+
+def _write_json(filename, value):
+    directory = os.path.dirname(filename)
+    try:
+        os.makedirs(directory)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    partial = "{}.{}".format(filename, os.getpid())
+    with open(partial, "w") as stream:
+        json.dump(value, stream, default=str)
+    os.rename(partial, filename)
+
+
+def _read_json(filename):
+    try:
+        with open(filename, "r") as stream:
+            return json.load(stream)
+    except (IOError, OSError, ValueError):
+        return None
@@ -0,0 +1,315 @@
+"""
+Keeps provenance on local disk until a collector takes it.
+
+A ``SpoolHandler`` appends each provenance record to a spool file as
+it is logged, as a json_lines record, so a job the scheduler kills
+has already written what it read and wrote. At exit, what the records
+don't say follows: the process, its script, and the counts, timings,
+and digests totalled since. Then the file is closed. Leaving the job
+costs a small local write whether or not logstash is up. A forwarder,
+running elsewhere, sends finished spool files, and the files of processes
+that died, to logstash, and removes each one after logstash has
+accepted all of it. A file that fails part-way is sent again whole,
+so logstash may see a record twice but never loses one.
+
+Run the forwarder as::
+
+    python -m provda.spool --spool /path/to/spool --host logstash --port 5000
+"""
+import argparse
+import atexit
+import datetime
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from .handler import json_lines, TCPSender
+
+
+logger = logging.getLogger("provda.spool")
+
+OPEN_SUFFIX = ".open"
+READY_SUFFIX = ".jsonl"
+
+
+class SpoolWriter(object):
+    """
+    An append-only spool file for one process. Writes go to a file
+    ending in ``.open``. Each record goes to the operating system as
+    it is appended, so it survives the process being killed. Records
+    are synced to disk, which survives the node going down, on close
+    and, if given, every ``sync_every`` records. Close renames the
+    file to end in ``.jsonl``, which tells the forwarder it is complete.
+    """
+    def __init__(self, directory, sync_every=1000):
+        """
+        :param directory: The spool directory. It is created if missing.
+        :param sync_every: Records between calls to fsync,
+                           or None to sync only on close.
+        """
+        try:
+            os.makedirs(directory)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        self.sync_every = sync_every
+        base = "{}-{}-{}".format(socket.gethostname(), os.getpid(),
+                                 uuid.uuid4().hex)
+        self.path = os.path.join(directory, base + READY_SUFFIX)
+        self._open_path = os.path.join(directory, base + OPEN_SUFFIX)
+        # Unbuffered, so nothing waits in this process to be written.
+        self._stream = open(self._open_path, "ab", buffering=0)
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def append(self, lines):
+        """
+        Appends json_lines records.
+
+        :param lines: An iterable of bytes, each ending in a newline.
+        :return: The number of records appended.
+        """
+        total = 0
+        with self._lock:
+            for line in lines:
+                self._stream.write(line)
+                total += 1
+                self._unsynced += 1
+                if self.sync_every is not None and \
+                        self._unsynced >= self.sync_every:
+                    self._sync()
+        return total
+
+    def append_document(self, document):
+        """
+        Appends every record of a document.
+
+        :param document: A ProcessDocument, its ``as_dict()``,
+                         or its ``json()``.
+        :return: The number of records appended.
+        """
+        return self.append(json_lines(document))
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._stream.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        """
+        Syncs and hands the file to the forwarder.
+        """
+        with self._lock:
+            if not self._stream.closed:
+                self._sync()
+                self._stream.close()
+                os.rename(self._open_path, self.path)
+
+
+class SpoolHandler(object):
+    """
+    A logging handler that appends each provenance record to a spool
+    file as it arrives, before any document is made from it. It takes
+    provenance straight from a ProvLogger, as a ProcessDocument does.
+    Records reach the operating system as they are logged, and are
+    synced to disk on close, so logging never waits on fsync.
+    """
+    def __init__(self, directory, document=None, sync_every=None):
+        """
+        :param directory: The spool directory.
+        :param document: The ProcessDocument these records go into,
+                         whose process id marks them.
+        :param sync_every: Records between calls to fsync,
+                           or None to sync only on close.
+        """
+        self.writer = SpoolWriter(directory, sync_every)
+        self.document_id = getattr(document, "_process_id", None)
+        self.hostname = socket.gethostname()
+        self.level = logging.DEBUG
+
+    def setLevel(self, level):
+        pass
+
+    def filter(self, record):
+        return hasattr(record, "prov")
+
+    def handle(self, record):
+        if not self.filter(record):
+            return
+        self.handle_prov(record.prov, getattr(record, "created", None))
+
+    def handle_prov(self, prov, created):
+        """
+        Appends one provenance record.
+
+        :param prov: The provenance dictionary.
+        :param created: When it was logged, as from time.time().
+        """
+        if created is None:
+            created = time.time()
+        record = json.dumps(
+            {'@message': 'provenance',
+             '@source_host': self.hostname,
+             '@version': 1,
+             'prov': prov.get("kind"),
+             'document': self.document_id,
+             '@timestamp': datetime.datetime.fromtimestamp(
+                 created).isoformat(),
+             "@fields": prov}, default=str)
+        self.writer.append([record.encode("utf-8") + b"\n"])
+
+    def close(self, document=None):
+        """
+        Appends what the document adds to the records spooled from it,
+        if given, and hands the spool file to the forwarder.
+
+        :param document: The ProcessDocument these records went into.
+        """
+        try:
+            if document is not None:
+                self.writer.append_document(document.settled_dict())
+        finally:
+            self.writer.close()
+
+
+def spool_document(document, directory):
+    """
+    Writes one document to its own spool file and closes it.
+
+    :param document: A ProcessDocument, its ``as_dict()``, or its ``json()``.
+    :param directory: The spool directory.
+    :return: The path to the spool file.
+    """
+    writer = SpoolWriter(directory)
+    try:
+        writer.append_document(document)
+    finally:
+        writer.close()
+    return writer.path
+
+
+def spool_at_exit(document, directory, logger=None):
+    """
+    Spools each provenance record as it is logged, and the process
+    and settled totals when the process exits, in place of sending the
+    document to logstash. Call it before logging any provenance, because
+    records logged earlier aren't spooled.
+
+    :param document: A ProcessDocument.
+    :param directory: The spool directory.
+    :param logger: The logger whose records to spool.
+                   Defaults to the root logger.
+    :return: The SpoolHandler.
+    """
+    handler = SpoolHandler(directory, document)
+    (logger or logging.root).addHandler(handler)
+    atexit.register(handler.close, document)
+    return handler
+
+
+def _abandoned(filename):
+    """
+    An open spool file whose process died on this host
+    will never be closed, so the forwarder takes it as it is.
+    """
+    host, pid = filename[:-len(OPEN_SUFFIX)].rsplit("-", 2)[:2]
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return False
+    except OSError as err:
+        return err.errno == errno.ESRCH
+    return False
+
+
+def ready_files(directory):
+    """
+    Spool files the forwarder can send, oldest first.
+
+    :param directory: The spool directory.
+    :return: A list of paths.
+    """
+    ready = list()
+    for filename in os.listdir(directory):
+        if filename.endswith(READY_SUFFIX) or (
+                filename.endswith(OPEN_SUFFIX) and _abandoned(filename)):
+            path = os.path.join(directory, filename)
+            try:
+                ready.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # Another forwarder sent and removed it.
+    return [path for (_, path) in sorted(ready)]
+
+
+def _complete_lines(stream, path):
+    """
+    The lines of a spool file, without a last line that has no newline,
+    which a process that died while writing it left half written.
+    """
+    for line in stream:
+        if line.endswith(b"\n"):
+            yield line
+        else:
+            logger.warning("Dropped a partial record at the end of {}".format(
+                path))
+
+
+def drain(directory, sender):
+    """
+    Sends every ready spool file and removes the ones that were sent.
+    Stops at the first file that fails, leaving it and the rest
+    for the next drain.
+
+    :param directory: The spool directory.
+    :param sender: A TCPSender.
+    :return: The number of files sent.
+    """
+    sent = 0
+    for path in ready_files(directory):
+        try:
+            with open(path, "rb") as stream:
+                total = sender.send_lines(_complete_lines(stream, path))
+        except (socket.error, OSError) as err:
+            logger.warning("Could not forward {}: {}".format(path, err))
+            break
+        logger.debug("forwarded {} records from {}".format(total, path))
+        os.remove(path)
+        sent += 1
+    return sent
+
+
+def forward(directory, host, port, interval=10):
+    """
+    Drains the spool directory to logstash forever.
+
+    :param directory: The spool directory.
+    :param host: Hostname of logstash.
+    :param port: Port it is on.
+    :param interval: Seconds to wait when there is nothing to send.
+    """
+    sender = TCPSender(host, port)
+    while True:
+        if not drain(directory, sender):
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Forwards spooled provenance to logstash.")
+    parser.add_argument("--spool", required=True,
+                        help="The spool directory.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--interval", type=float, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    forward(args.spool, args.host, args.port, args.interval)
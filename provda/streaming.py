@@ -0,0 +1,181 @@
+"""
+Writes a provenance document to a stream a record at a time, as
+PROV-JSON or PROV-N, so the whole document never exists as one string.
+
+``ProcessDocument.json()`` and ``str()`` build the full text in memory,
+and PROV-JSON goes through a dictionary of the whole document first.
+These write the same text, record by record, to a file, or to a socket
+through ``socket.makefile("w")``::
+
+    with open("provenance.json", "w") as stream:
+        model.write_json(stream)
+"""
+import json
+from prov.constants import PROV_ATTRIBUTE_LITERALS, PROV_ATTRIBUTE_QNAMES, \
+    PROV_N_MAP
+from prov.serializers.provjson import encode_json_representation
+try:
+    from prov.serializers.provjson import _xsd_datetime_text
+except ImportError:
+    def _xsd_datetime_text(value):  # Older prov writes isoformat.
+        return value.isoformat()
+
+
+def _first(values):
+    return next(iter(values))
+
+
+def _record_json(record):
+    """
+    The PROV-JSON attributes of one record, as prov's serializer
+    would write them.
+    """
+    record_json = dict()
+    for attr, values in record._attributes.items():
+        if not values:
+            continue
+        name = str(attr)
+        if attr in PROV_ATTRIBUTE_QNAMES:
+            record_json[name] = str(_first(values))
+        elif attr in PROV_ATTRIBUTE_LITERALS:
+            record_json[name] = _xsd_datetime_text(_first(values))
+        elif len(values) == 1:
+            record_json[name] = encode_json_representation(_first(values))
+        else:
+            record_json[name] = [encode_json_representation(value)
+                                 for value in values]
+    return record_json
+
+
+def _identified(records):
+    """
+    Each record with its identifier. Records without one are
+    numbered "_:id1", "_:id2", in order, as prov numbers them.
+    """
+    anonymous = 0
+    for record in records:
+        if record.identifier is None:
+            anonymous += 1
+            yield "_:id{}".format(anonymous), record
+        else:
+            yield str(record.identifier), record
+
+
+def _write_container(bundle, stream, close=True):
+    """
+    Writes a bundle's prefixes and records as a PROV-JSON container.
+
+    :param close: Whether to write the closing brace, or leave
+                  the container open for the document's bundles.
+    :return: What separates the next entry in the container.
+    """
+    records = bundle.get_records()
+    # The kinds in the order they first appear, and identifiers
+    # that more than one record of a kind shares, which are rare.
+    kinds = list()
+    seen = dict()
+    shared = set()
+    for identifier, record in _identified(records):
+        kind = PROV_N_MAP[record.get_type()]
+        if kind not in seen:
+            kinds.append(kind)
+            seen[kind] = set()
+        if identifier in seen[kind]:
+            shared.add((kind, identifier))
+        elif not identifier.startswith("_:"):
+            seen[kind].add(identifier)
+    del seen
+
+    prefixes = dict()
+    for namespace in bundle.get_registered_namespaces():
+        prefixes[namespace.prefix] = namespace.uri
+    default = bundle.get_default_namespace()
+    if default is not None:
+        prefixes["default"] = default.uri
+    stream.write("{")
+    separator = ""
+    if prefixes:
+        stream.write('"prefix": ')
+        stream.write(json.dumps(prefixes))
+        separator = ", "
+    # One pass over the records for each kind keeps memory flat.
+    for kind in kinds:
+        stream.write('{}"{}": {{'.format(separator, kind))
+        separator = ", "
+        between = ""
+        written = set()
+        for identifier, record in _identified(records):
+            if PROV_N_MAP[record.get_type()] != kind:
+                continue
+            if (kind, identifier) in shared:
+                if identifier in written:
+                    continue
+                written.add(identifier)
+                value = [_record_json(other)
+                         for (other_id, other) in _identified(records)
+                         if other_id == identifier and
+                         PROV_N_MAP[other.get_type()] == kind]
+            else:
+                value = _record_json(record)
+            stream.write(between)
+            stream.write(json.dumps(identifier))
+            stream.write(": ")
+            stream.write(json.dumps(value))
+            between = ", "
+        stream.write("}")
+    if close:
+        stream.write("}")
+    return separator
+
+
+def write_json(document, stream):
+    """
+    Writes PROV-JSON, the same as prov's serializer makes,
+    one record at a time.
+
+    :param document: A prov.model.ProvDocument.
+    :param stream: A text stream open for writing.
+    """
+    bundles = list(document.bundles)
+    separator = _write_container(document, stream, close=not bundles)
+    if not bundles:
+        return
+    stream.write('{}"bundle": {{'.format(separator))
+    between = ""
+    for bundle in bundles:
+        stream.write(between)
+        stream.write(json.dumps(str(bundle.identifier)))
+        stream.write(": ")
+        _write_container(bundle, stream)
+        between = ", "
+    stream.write("}}")
+
+
+def write_provn(document, stream):
+    """
+    Writes PROV-N, the same as ``document.get_provn()`` makes,
+    one record at a time.
+
+    :param document: A prov.model.ProvDocument.
+    :param stream: A text stream open for writing.
+    """
+    newline = "\n  "
+    stream.write("document")
+    default = document.get_default_namespace()
+    declared = False
+    if default is not None:
+        stream.write("{}default <{}>".format(newline, default.uri))
+        declared = True
+    for namespace in document.get_registered_namespaces():
+        stream.write("{}prefix {} <{}>".format(
+            newline, namespace.prefix, namespace.uri))
+        declared = True
+    if declared:
+        stream.write(newline)
+    for record in document.get_records():
+        stream.write(newline)
+        stream.write(record.get_provn())
+    for bundle in document.bundles:
+        stream.write(newline)
+        stream.write(bundle.get_provn(1))
+    stream.write("\nendDocument")
@@ -0,0 +1,232 @@
+"""
+Merges the documents of many processes into one provenance graph
+for a whole workflow.
+
+A process that starts tasks records a ``unk:processcollection`` whose
+members are entities for the task ids, and each task's own document
+has an activity with ``unk:sge_job_id``. Merging links each task's
+activity to the member for its job id, with a ``wasStartedBy`` whose
+trigger is the member and whose starter is the process that started
+it. Entities and agents that many documents share, such as a common
+input file, appear once. Every process names its collection of tasks
+``unk:processcollection``, so each is renamed for the activity that
+started the tasks, and the merged graph keeps one for each run.
+
+Documents are read one at a time, and the merged graph is written to
+temporary files, one for each kind of record, as it grows, so memory
+holds only the identifiers needed to link and deduplicate::
+
+    merger = WorkflowMerger("workflow.json")
+    for document in documents:
+        merger.add(document)
+    merger.close()
+"""
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import json
+import logging
+import shutil
+import tempfile
+from .lineage import _document_dict, _plain
+
+
+logger = logging.getLogger("provda.workflow")
+
+# Kinds whose records are identified by name, so they are shared.
+_NAMED = ("entity", "agent")
+_COLLECTION = "unk:processcollection"
+
+
+def _collection_names(document):
+    """
+    A name for each task collection in one document that is unique
+    to the activity that started the tasks, as
+    "unk:processcollection-<activity>", keyed by the old name.
+    """
+    starters = dict()
+    for relation in document.get("wasInfluencedBy", {}).values():
+        if isinstance(relation, Mapping):
+            starters[relation.get("prov:influencee")] = \
+                relation.get("prov:influencer")
+    activities = list(document.get("activity", {}))
+    renamed = dict()
+    for identifier in document.get("entity", {}):
+        if identifier != _COLLECTION:
+            continue
+        starter = starters.get(identifier) or \
+            (activities[0] if activities else None)
+        if starter is not None:
+            renamed[identifier] = "{}-{}".format(
+                _COLLECTION, starter.split(":", 1)[-1])
+    return renamed
+
+
+class WorkflowMerger(object):
+    """
+    Writes one PROV-JSON document from many.
+    """
+    def __init__(self, output):
+        """
+        :param output: A filename or a text stream open for writing.
+        """
+        self.output = output
+        self._prefixes = dict()
+        self._sections = dict()
+        self._seen = {kind: set() for kind in _NAMED}
+        # Task id to (member entity, the activity that started it),
+        # and job ids of tasks merged before whoever started them.
+        self._members = dict()
+        self._waiting = dict()
+        self._relations = 0
+        self.documents = 0
+        self.linked = 0
+
+    def _write(self, kind, identifier, attributes):
+        section = self._sections.get(kind)
+        if section is None:
+            section = tempfile.TemporaryFile(mode="w+")
+            self._sections[kind] = [section, 0]
+        else:
+            section = section[0]
+        if self._sections[kind][1]:
+            section.write(",\n")
+        section.write(json.dumps(identifier))
+        section.write(": ")
+        section.write(json.dumps(attributes))
+        self._sections[kind][1] += 1
+
+    def _relation(self, kind, attributes):
+        self._relations += 1
+        self._write(kind, "_:w{}".format(self._relations), attributes)
+
+    def add(self, document):
+        """
+        Adds one process's document to the workflow.
+
+        :param document: A ProcessDocument, its ``as_dict()``,
+                         or its ``json()``.
+        """
+        document = _document_dict(document)
+        self.documents += 1
+        self._prefixes.update(document.get("prefix", {}))
+        renamed = _collection_names(document)
+        groups = dict()
+        for kind, records in document.items():
+            if kind == "prefix" or not isinstance(records, Mapping):
+                continue
+            for identifier, attributes in records.items():
+                identifier = renamed.get(identifier, identifier)
+                instances = attributes if isinstance(attributes, list) \
+                    else [attributes]
+                for instance in instances:
+                    if renamed:
+                        instance = {key: renamed.get(value, value)
+                                    if isinstance(value, str) else value
+                                    for (key, value) in instance.items()}
+                    if kind in _NAMED:
+                        if identifier in self._seen[kind]:
+                            continue
+                        self._seen[kind].add(identifier)
+                        self._write(kind, identifier, instance)
+                    elif kind == "activity":
+                        self._write(kind, identifier, instance)
+                        job_id = _plain(instance.get("unk:sge_job_id"))
+                        if job_id is not None:
+                            self._task(str(job_id), identifier)
+                    elif identifier.startswith("_:"):
+                        self._relation(kind, instance)
+                        self._collect(kind, instance, groups)
+                    else:
+                        self._write(kind, identifier, instance)
+        for task_id, member, starter in self._started(groups):
+            self._members[task_id] = (member, starter)
+            for activity in self._waiting.pop(task_id, ()):
+                self._link(activity, member, starter)
+
+    def _collect(self, kind, relation, groups):
+        """
+        Notes which collections have which members, and which activity
+        each collection influenced, from one document's relations.
+        """
+        if kind == "hadMember":
+            groups.setdefault(
+                relation.get("prov:collection"), [None, []])[1].append(
+                relation.get("prov:entity"))
+        elif kind == "wasInfluencedBy":
+            groups.setdefault(
+                relation.get("prov:influencee"), [None, []])[0] = \
+                relation.get("prov:influencer")
+
+    def _started(self, groups):
+        for collection, (starter, members) in groups.items():
+            if collection is None or not collection.startswith(_COLLECTION):
+                continue
+            for member in members:
+                # Members are "doc:<task id>".
+                yield member.split(":", 1)[1], member, starter
+
+    def _task(self, job_id, activity):
+        started = self._members.get(job_id)
+        if started is None:
+            self._waiting.setdefault(job_id, list()).append(activity)
+        else:
+            self._link(activity, *started)
+
+    def _link(self, activity, member, starter):
+        self.linked += 1
+        self._relation("wasStartedBy", {
+            "prov:activity": activity,
+            "prov:trigger": member,
+            "prov:starter": starter
+        })
+
+    def close(self):
+        """
+        Writes the merged document and removes temporary files.
+
+        :return: The number of tasks that were never linked to
+                 a process that started them.
+        """
+        if isinstance(self.output, str):
+            with open(self.output, "w") as stream:
+                self._write_document(stream)
+        else:
+            self._write_document(self.output)
+        unlinked = sum(len(v) for v in self._waiting.values())
+        if unlinked:
+            logger.info("{} tasks had no process that started them".format(
+                unlinked))
+        logger.debug("Merged {} documents and linked {} tasks".format(
+            self.documents, self.linked))
+        return unlinked
+
+    def _write_document(self, stream):
+        stream.write('{"prefix": ')
+        stream.write(json.dumps(self._prefixes))
+        for kind, (section, _) in self._sections.items():
+            stream.write(",\n{}: {{\n".format(json.dumps(kind)))
+            section.seek(0)
+            shutil.copyfileobj(section, stream)
+            stream.write("\n}")
+            section.close()
+        stream.write("}\n")
+        self._sections = dict()
+
+
+def merge_documents(documents, output):
+    """
+    Merges documents into one workflow document.
+
+    :param documents: An iterable of ProcessDocuments, their
+                      ``as_dict()``, or their ``json()``.
+    :param output: A filename or a text stream open for writing.
+    :return: The WorkflowMerger, which has counts of documents
+             and linked tasks.
+    """
+    merger = WorkflowMerger(output)
+    for document in documents:
+        merger.add(document)
+    merger.close()
+    return merger
@@ -0,0 +1,75 @@
+"""
+Times adding settings flags to an argparse parser, and parsing,
+as the number of settings grows. It compares resolving every
+setting to find its type, as add_arguments used to, with reading
+stored settings, and with adding only the flags on the command line.
+
+    python bench_arguments.py --settings 100 1000 5000
+"""
+import argparse
+import timeit
+import provda
+import provda.parameters
+
+
+def resolve_each(parser):
+    """
+    Adds flags the way add_arguments did before it read stored settings.
+    """
+    group = parser.add_argument_group("settings")
+    flags = dict()
+    for qualify, parameters in \
+            provda.parameters.Parameters.manager.parameters_dict.items():
+        if isinstance(parameters, provda.parameters.Parameters):
+            for name in parameters:
+                try:
+                    flags["{}.{}".format(qualify, name)] = parameters[name]
+                except KeyError:
+                    flags["{}.{}".format(qualify, name)] = "None"
+    for flag in sorted(flags):
+        value = flags[flag]
+        if isinstance(value, (int, float, str)):
+            group.add_argument("--{}".format(flag), type=type(value))
+        else:
+            group.add_argument("--{}".format(flag))
+
+
+def make_settings(total, modules=20):
+    for module in range(modules):
+        settings = dict()
+        for idx in range(total // modules):
+            settings["draws{}".format(idx)] = provda.int(idx)
+            settings["out{}".format(idx)] = provda.path_template(
+                "out/{{draws{}}}_{{location}}.hdf".format(idx), "w")
+        settings["location"] = "Kenya"
+        provda.get_parameters("bench.m{}".format(module), settings)
+
+
+def run(counts, repeat):
+    argv = ["--bench.m3.draws1", "4", "--location", "Peru"]
+    print("{:>9} {:>14} {:>14} {:>14}".format(
+        "settings", "resolve ms", "stored ms", "named ms"))
+    made = 0
+    for count in counts:
+        make_settings(count - made)
+        made = count
+        times = list()
+        for add in [
+                lambda p: resolve_each(p),
+                lambda p: provda.parameters.add_arguments(p),
+                lambda p: provda.parameters.add_arguments(p, argv)]:
+            def startup():
+                parser = argparse.ArgumentParser()
+                add(parser)
+                parser.parse_known_args(argv)
+            times.append(1e3 * timeit.timeit(startup, number=repeat) / repeat)
+        print("{:>9} {:>14.1f} {:>14.1f} {:>14.1f}".format(count, *times))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--settings", type=int, nargs="+",
+                        default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.settings, args.repeat)
@@ -0,0 +1,58 @@
+"""
+Compares the size of a document, and the time to encode and decode
+it, as PROV-JSON and in provda's binary form, with and without zlib.
+
+    python bench_binary.py --files 20000
+"""
+import argparse
+import json
+import time
+import zlib
+import provda.binary
+import provda.logprov
+import provda.model
+from test_document import namespaces
+
+
+def busy_document(files):
+    m = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("bench_binary")
+    l.addHandler(m)
+    for idx in range(files):
+        l.read_file("/ihme/forecasting/draws/{}/in.hdf".format(idx), "input")
+        l.read_file("/ihme/forecasting/draws/{}/in.hdf".format(idx), "input")
+        l.write_file("/ihme/forecasting/out/{}.hdf".format(idx), "output")
+    return m
+
+
+def timed(work):
+    start = time.time()
+    result = work()
+    return result, 1e3 * (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20000)
+    args = parser.parse_args()
+    m = busy_document(args.files)
+    as_dict = m.as_dict()
+    print("{:>14} {:>10} {:>10} {:>10}".format(
+        "", "MB", "encode ms", "decode ms"))
+    for name, encode, decode in [
+            ("json", lambda: json.dumps(as_dict).encode("utf-8"),
+             lambda data: json.loads(data.decode("utf-8"))),
+            ("json+zlib",
+             lambda: zlib.compress(json.dumps(as_dict).encode("utf-8")),
+             lambda data: json.loads(zlib.decompress(data).decode("utf-8"))),
+            ("binary", lambda: provda.binary.encode(as_dict, False),
+             provda.binary.decode),
+            ("binary+zlib", lambda: provda.binary.encode(as_dict),
+             provda.binary.decode)]:
+        data, encode_ms = timed(encode)
+        decoded, decode_ms = timed(lambda: decode(data))
+        assert decoded == as_dict
+        print("{:>14} {:>10.2f} {:>10.1f} {:>10.1f}".format(
+            name, len(data) / 1e6, encode_ms, decode_ms))
+    _, prov_ms = timed(m.json)
+    print("ProcessDocument.json() through prov: {:.1f} ms".format(prov_ms))
@@ -0,0 +1,24 @@
+"""
+Times how long it takes to describe the running script's git
+repository by asking GitPython and by reading the .git directory.
+Run it from inside a git checkout.
+
+    python bench_collect.py --count 100
+"""
+import argparse
+import timeit
+import provda.collect
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100)
+    args = parser.parse_args()
+    script_path = provda.collect._script_path()
+    for name, work in [
+            ("GitPython", lambda: provda.collect._ask_git(script_path)),
+            ("read_repository",
+             lambda: provda.collect._inspect_script(script_path))]:
+        seconds = timeit.timeit(work, number=args.count)
+        print("{:>16}: {:.3f} ms per call".format(
+            name, 1e3 * seconds / args.count))
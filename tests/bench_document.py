@@ -0,0 +1,48 @@
+"""
+Measures how long a process spends in the logging call when it
+records many file reads and writes, with a ProcessDocument handler
+that builds the document inline and with a BatchedProcessDocument.
+
+    python bench_document.py --count 100000
+"""
+import argparse
+import time
+import provda.logprov
+import provda.model
+
+
+namespaces = {
+    "is": "https://healthdata.org/instances",
+    "people": "https://healthdata.org/people",
+    "code": "https://healthdata.org/code",
+    "doc": "https://healthdata.org/document"
+}
+
+
+def run(document, count):
+    prov_logger = provda.logprov.ProvLogger("bench_document")
+    prov_logger.addHandler(document)
+    start = time.time()
+    for idx in range(count):
+        if idx % 2:
+            prov_logger.read_file("/ihme/in/{}.hdf".format(idx), "input")
+        else:
+            prov_logger.write_file("/ihme/out/{}.hdf".format(idx), "output")
+    logged = time.time() - start
+    if hasattr(document, "flush"):
+        document.flush()
+    finished = time.time() - start
+    return logged, finished
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    for name, document in [
+            ("ProcessDocument", provda.model.ProcessDocument(namespaces)),
+            ("BatchedProcessDocument",
+             provda.model.BatchedProcessDocument(namespaces))]:
+        logged, finished = run(document, args.count)
+        print("{:>22}: {:.0f} records/s in caller, {:.2f} s until in document"
+              .format(name, args.count / logged, finished))
@@ -0,0 +1,80 @@
+"""
+Times ingesting synthetic provenance documents into a LineageStore
+and looking up lineage once it holds millions of events.
+
+    python bench_lineage.py --documents 10000 --events 100
+"""
+import argparse
+import os
+import tempfile
+import time
+import provda.lineage
+
+
+def synthetic(index, events):
+    """
+    A PROV-JSON document for one task that reads a shared input,
+    reads its own inputs, and writes one output.
+    """
+    activity = "is:task-{}".format(index)
+    stamp = "2017-01-01T00:00:{:02d}.{:06d}".format(index % 60, index)
+    used = {"_:id0": {"prov:activity": activity,
+                      "prov:entity": "doc:/shared/population.hdf",
+                      "prov:time": stamp}}
+    for event in range(1, events):
+        used["_:id{}".format(event)] = {
+            "prov:activity": activity,
+            "prov:entity": "doc:/draws/{}/{}.csv".format(index, event),
+            "prov:time": stamp}
+    return {
+        "activity": {activity: {"unk:sge_job_id": str(index // 100),
+                                "unk:hostname": "node{}".format(index % 50),
+                                "unk:date": stamp}},
+        "used": used,
+        "wasGeneratedBy": {"_:out": {
+            "prov:activity": activity,
+            "prov:entity": "doc:/results/{}.hdf".format(index),
+            "prov:time": stamp}}
+    }
+
+
+def timed(name, work, repeat=100):
+    start = time.time()
+    for _ in range(repeat):
+        result = work()
+    print("{:>24}: {:.3f} ms".format(
+        name, 1e3 * (time.time() - start) / repeat))
+    return result
+
+
+def run(documents, events, batch):
+    directory = tempfile.mkdtemp()
+    store = provda.lineage.LineageStore(os.path.join(directory, "lineage.db"))
+    start = time.time()
+    total = 0
+    for first in range(0, documents, batch):
+        total += store.ingest(
+            synthetic(index, events)
+            for index in range(first, min(first + batch, documents)))
+    seconds = time.time() - start
+    print("ingested {} events in {:.1f} s, {:.0f} events/s".format(
+        total, seconds, total / seconds))
+    middle = documents // 2
+    timed("writers of a file",
+          lambda: store.writers("/results/{}.hdf".format(middle)))
+    timed("what a run read",
+          lambda: store.inputs("is:task-{}".format(middle)))
+    timed("runs in an SGE job",
+          lambda: store.activities(sge_job_id=str(middle // 100)))
+    timed("readers of shared input",
+          lambda: store.readers("/shared/population.hdf"), repeat=3)
+    store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    run(args.documents, args.events, args.batch)
@@ -0,0 +1,65 @@
+"""
+Measures the overhead a provda.patch wrapper adds to a call,
+when the only handler is a ProcessDocument, which takes provenance
+without a LogRecord, and when a StreamHandler also listens, which
+makes every call build a LogRecord.
+
+    python bench_patch.py --count 100000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import timeit
+import provda.model
+import provda.patch
+
+
+namespaces = {
+    "is": "https://healthdata.org/instances",
+    "people": "https://healthdata.org/people",
+    "code": "https://healthdata.org/code",
+    "doc": "https://healthdata.org/document"
+}
+
+
+def save(path):
+    return path
+
+
+def per_call(work, count):
+    return 1e6 * timeit.timeit(work, number=count) / count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    wrapped = provda.patch.report_write(save)
+    descriptor, target = tempfile.mkstemp(suffix=".npy")
+    os.close(descriptor)
+
+    bare = per_call(lambda: save(target), args.count)
+    print("{:>28}: {:.3f} us per call".format("unwrapped", bare))
+
+    model = provda.model.ProcessDocument(namespaces)
+    logging.root.addHandler(model)
+    direct = per_call(lambda: wrapped(target), args.count)
+    print("{:>28}: {:.3f} us per call".format(
+        "wrapped, ProcessDocument", direct))
+
+    logging.root.addHandler(logging.NullHandler())
+    with_record = per_call(lambda: wrapped(target), args.count)
+    print("{:>28}: {:.3f} us per call".format(
+        "wrapped, with LogRecord", with_record))
+
+    logging.root.handlers.pop()
+
+    with open(target, "rb") as source:
+        plain = per_call(lambda: source.read(0), args.count)
+    with provda.patch.open(target, "rb") as source:
+        counted = per_call(lambda: source.read(0), args.count)
+    print("{:>28}: {:.3f} us per call".format("file.read", plain))
+    print("{:>28}: {:.3f} us per call".format(
+        "provda.patch.open().read", counted))
+    os.remove(target)
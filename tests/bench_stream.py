@@ -0,0 +1,37 @@
+"""
+Compares peak memory and time to write a large document to a file
+by making the whole string and by streaming it a record at a time.
+
+    python bench_stream.py --files 20000
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from bench_binary import busy_document
+
+
+def measured(work):
+    tracemalloc.start()
+    start = time.time()
+    work()
+    elapsed = 1e3 * (time.time() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20000)
+    args = parser.parse_args()
+    m = busy_document(args.files)
+    m._settle()
+    with open(os.devnull, "w") as devnull:
+        print("{:>14} {:>10} {:>10}".format("", "ms", "peak MB"))
+        for name, work in [
+                ("json()", lambda: devnull.write(m.json())),
+                ("write_json", lambda: m.write_json(devnull)),
+                ("str()", lambda: devnull.write(str(m))),
+                ("write_provn", lambda: m.write_provn(devnull))]:
+            print("{:>14} {:>10.1f} {:>10.1f}".format(name, *measured(work)))
@@ -0,0 +1,63 @@
+"""
+Times resolution of string and path templates through the original
+FormatterMissing parser and through the compiled template cache.
+
+    python bench_templates.py --count 100000
+"""
+import argparse
+import logging
+import timeit
+import provda
+from provda.datatypes import FormatterMissing, compile_template
+
+
+logger = logging.getLogger("bench_templates")
+
+
+TEMPLATES = [
+    "workdir/cod{acause}_{date}_{sex_id}.csv",
+    "{acause}_{risk}",
+    "plain/path/without/fields.hdf",
+    "draws{draw:04d}",
+]
+
+
+def run(count):
+    mapping = {"acause": "cvd_ihd", "date": "2016_03_07", "sex_id": 2,
+               "risk": "smoking", "draw": 7}
+    parsed = FormatterMissing()
+
+    def parse_each_time():
+        for template in TEMPLATES:
+            parsed.vformat(template, [], mapping)
+
+    def compiled():
+        for template in TEMPLATES:
+            compile_template(template).format([], mapping)
+
+    for name, work in [("FormatterMissing", parse_each_time),
+                       ("compile_template", compiled)]:
+        seconds = timeit.timeit(work, number=count)
+        print("{:>18}: {:.3f} us per template".format(
+            name, 1e6 * seconds / (count * len(TEMPLATES))))
+
+    params = provda.get_parameters("bench_templates", {
+        "acause": "cvd_ihd",
+        "date": "2016_03_07",
+        "sex_id": provda.int(2),
+        "cod_in": provda.path_template(TEMPLATES[0], "r"),
+        "label": provda.string(TEMPLATES[1]),
+        "risk": "smoking",
+    })
+    seconds = timeit.timeit(lambda: params["cod_in"], number=count)
+    print("{:>18}: {:.3f} us per read".format(
+        "path_template", 1e6 * seconds / count))
+    seconds = timeit.timeit(lambda: params["label"], number=count)
+    print("{:>18}: {:.3f} us per read".format("string", 1e6 * seconds / count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    run(args.count)
@@ -0,0 +1,84 @@
+"""
+Times merging the documents of a large workflow, in which parent
+processes each start many tasks, and reports peak memory.
+
+    python bench_workflow.py --tasks 50000 --per-parent 1000
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+import provda.workflow
+
+
+PREFIX = {"is": "https://healthdata.org/instances",
+          "doc": "https://healthdata.org/document",
+          "unk": "http://example.com/unknown"}
+
+
+def parent(index, job_ids):
+    activity = "is:parent-{}".format(index)
+    collection = "unk:processcollection"
+    return {
+        "prefix": PREFIX,
+        "activity": {activity: {"unk:hostname": "head"}},
+        "entity": dict([(collection, {"prov:type": "prov:Collection"})] + [
+            ("doc:{}".format(job), {"unk:task_id": job}) for job in job_ids]),
+        "hadMember": {"_:id{}".format(idx): {
+            "prov:collection": collection,
+            "prov:entity": "doc:{}".format(job)}
+            for (idx, job) in enumerate(job_ids)},
+        "wasInfluencedBy": {"_:influence": {
+            "prov:influencee": collection, "prov:influencer": activity}}
+    }
+
+
+def task(job):
+    activity = "is:task-{}".format(job)
+    return {
+        "prefix": PREFIX,
+        "activity": {activity: {"unk:sge_job_id": job}},
+        "entity": {"doc:/shared/population.hdf": {},
+                   "doc:/draws/{}.csv".format(job): {},
+                   "doc:/results/{}.hdf".format(job): {}},
+        "used": {
+            "_:id1": {"prov:activity": activity,
+                      "prov:entity": "doc:/shared/population.hdf"},
+            "_:id2": {"prov:activity": activity,
+                      "prov:entity": "doc:/draws/{}.csv".format(job)}},
+        "wasGeneratedBy": {
+            "_:id3": {"prov:activity": activity,
+                      "prov:entity": "doc:/results/{}.hdf".format(job)}}
+    }
+
+
+def documents(tasks, per_parent):
+    for first in range(0, tasks, per_parent):
+        job_ids = [str(job) for job in range(first, min(first + per_parent,
+                                                        tasks))]
+        # Half the tasks arrive before the process that started them.
+        half = len(job_ids) // 2
+        for job in job_ids[:half]:
+            yield task(job)
+        yield parent(first, job_ids)
+        for job in job_ids[half:]:
+            yield task(job)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=50000)
+    parser.add_argument("--per-parent", type=int, default=1000)
+    args = parser.parse_args()
+    output = os.path.join(tempfile.mkdtemp(), "workflow.json")
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    merger = provda.workflow.merge_documents(
+        documents(args.tasks, args.per_parent), output)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("merged {} documents, linked {} tasks in {:.1f} s".format(
+        merger.documents, merger.linked, seconds))
+    print("output {:.1f} MB, peak memory grew {:.1f} MB".format(
+        os.path.getsize(output) / 1e6, (peak - before) / 1e3))
@@ -35,6 +35,8 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logger.debug("pid {} gpid {}".format(os.getpid(),
                                          os.getpgid(os.getpid())))
-    p = Pool(2)
+    # Workers answer from a resolved snapshot instead of rebuilding it.
+    p = Pool(2, initializer=provda.install_parameters,
+             initargs=(provda.freeze_parameters(),))
     G = 3
     p.map(run, [3, 7, "incongruent"])
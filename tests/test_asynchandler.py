@@ -0,0 +1,75 @@
+import asyncio
+import json
+import threading
+import provda.asynchandler
+import provda.model
+
+
+namespaces = {
+    "is": "https://healtdata.org/instances",
+    "people": "https://healthdata.org/people",
+    "code": "https://healthdata.org/code",
+    "doc": "https://healthdata.org/document"
+}
+
+
+def test_ship_many():
+    documents = [provda.model.ProcessDocument(namespaces) for i in range(5)]
+    lines = list()
+
+    async def collect(reader, writer):
+        async for line in reader:
+            lines.append(json.loads(line.decode("utf-8")))
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(collect, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        shipper = provda.asynchandler.AsyncShipper(
+            "localhost", port, concurrency=2, batch_bytes=100)
+        sent = await shipper.ship_many(documents)
+        await asyncio.sleep(0.1)
+        server.close()
+        await server.wait_closed()
+        return sent
+
+    sent = asyncio.run(run())
+    assert all(isinstance(count, int) for count in sent)
+    assert len(lines) == sum(sent)
+    assert len({line["document"] for line in lines}) == 5
+
+
+def test_unreachable_fails_one():
+    documents = [provda.model.ProcessDocument(namespaces)]
+    sent = provda.asynchandler.ship_documents(documents, "localhost", 1,
+                                              timeout=2)
+    assert isinstance(sent[0], Exception)
+
+
+def test_records_made_off_the_loop(monkeypatch):
+    threads = list()
+    json_lines = provda.asynchandler.json_lines
+
+    def record_thread(document):
+        threads.append(threading.current_thread())
+        for line in json_lines(document):
+            yield line
+
+    monkeypatch.setattr(provda.asynchandler, "json_lines", record_thread)
+
+    async def collect(reader, writer):
+        async for line in reader:
+            pass
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(collect, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        shipper = provda.asynchandler.AsyncShipper("localhost", port)
+        sent = await shipper.ship(provda.model.ProcessDocument(namespaces))
+        server.close()
+        await server.wait_closed()
+        return sent
+
+    assert asyncio.run(run()) > 0
+    assert threads and threads[0] is not threading.main_thread()
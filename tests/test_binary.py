@@ -0,0 +1,44 @@
+import json
+import pytest
+import provda.binary
+import provda.logprov
+import provda.model
+from test_document import namespaces
+
+
+def busy_document():
+    m = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("provda.tests.binary")
+    l.addHandler(m)
+    for idx in range(50):
+        l.read_file("/ihme/forecasting/in{}.hdf".format(idx), "input")
+        l.read_file("/ihme/forecasting/in{}.hdf".format(idx), "input")
+    l.write_file("/ihme/forecasting/out.hdf", "output")
+    l.write_table("db", "schema", "table", "output")
+    l.start_tasks("calculate_pafs", ["11", "12"])
+    return m
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip(compress):
+    m = busy_document()
+    as_json = m.json()
+    data = m.binary(compress)
+    assert len(data) < len(as_json) / 2
+    assert provda.binary.decode(data) == json.loads(as_json)
+    assert provda.binary.to_prov(data) == m._document
+
+
+def test_values():
+    document = {"prefix": {"a": "http://a"}, "entity": {"a:x": {
+        "n": -3, "big": 2 ** 40, "f": 1.5, "t": True, "none": None,
+        "many": ["a:y", {"$": "2", "type": "xsd:int"}], "empty": {}}}}
+    assert provda.binary.decode(provda.binary.encode(document)) == document
+
+
+def test_rejects_other_bytes():
+    with pytest.raises(provda.binary.BadBinaryDocument):
+        provda.binary.decode(b"{}")
+    data = provda.binary.encode({"entity": {"a:x": {}}}, compress=False)
+    with pytest.raises(provda.binary.BadBinaryDocument):
+        provda.binary.decode(data[:-2])
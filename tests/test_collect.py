@@ -0,0 +1,62 @@
+import os
+import provda.collect
+
+
+def test_this_script_is_cached(tmpdir, monkeypatch):
+    monkeypatch.setenv("PROVDA_CACHE", str(tmpdir))
+    first = provda.collect.this_script()
+    second = provda.collect.this_script()
+    assert first == second
+    if provda.collect.find_git_dir(".") is not None:
+        assert len(os.listdir(str(tmpdir))) == 1
+
+
+def test_this_process_keeps_start():
+    traits = provda.collect.this_process(1000000000)
+    assert traits["unk:date"].startswith("2001")
+
+
+def test_read_repository(tmpdir):
+    git_dir = tmpdir.mkdir(".git")
+    git_dir.join("HEAD").write("ref: refs/heads/feature/x\n")
+    git_dir.join("packed-refs").write(
+        "# pack-refs with: peeled fully-peeled sorted\n"
+        "11b0ff5d9c026e8313f445bdf4103cdf38d0a63e refs/heads/feature/x\n")
+    git_dir.join("config").write(
+        "[core]\n\tbare = false\n"
+        "[remote \"origin\"]\n"
+        "\turl = https://example.com/r.git\n"
+        "\tfetch = +refs/heads/*:refs/remotes/origin/*\n")
+    working_dir, found = provda.collect.find_repository(
+        str(tmpdir.mkdir("sub")))
+    assert found == str(git_dir)
+    repo = provda.collect.read_repository(working_dir, found)
+    assert repo == {
+        "unk:version_branch": "feature/x",
+        "unk:version_branch_hash": "11b0ff5d9c026e8313f445bdf4103cdf38d0a63e",
+        "unk:version_remote": "https://example.com/r.git"
+    }
+
+
+def test_detached_head_has_no_branch(tmpdir):
+    git_dir = tmpdir.mkdir(".git")
+    git_dir.join("HEAD").write("11b0ff5d9c026e8313f445bdf4103cdf38d0a63e\n")
+    git_dir.join("config").write("[core]\n\tbare = false\n")
+    repo = provda.collect.read_repository(str(tmpdir), str(git_dir))
+    assert repo == {
+        "unk:version_branch_hash": "11b0ff5d9c026e8313f445bdf4103cdf38d0a63e",
+        "unk:version_remote": "local"
+    }
+
+
+def test_worktree_state_follows_its_branch(tmpdir):
+    common = tmpdir.mkdir(".git")
+    common.join("config").write("[core]\n\tbare = false\n")
+    branch = common.mkdir("refs").mkdir("heads").join("topic")
+    branch.write("11b0ff5d9c026e8313f445bdf4103cdf38d0a63e\n")
+    worktree = common.mkdir("worktrees").mkdir("topic")
+    worktree.join("commondir").write("../..\n")
+    worktree.join("HEAD").write("ref: refs/heads/topic\n")
+    before = provda.collect._repository_state(str(worktree))
+    branch.write("22b0ff5d9c026e8313f445bdf4103cdf38d0a63e\n")
+    assert provda.collect._repository_state(str(worktree)) != before
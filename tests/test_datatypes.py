@@ -0,0 +1,34 @@
+import pytest
+from provda.datatypes import FormatterMissing, compile_template, _vformat
+
+
+MAPPING = {"acause": "cvd_ihd", "sex_id": 2, "width": 6, "empty": None,
+           "nested": {"key": "value"}}
+
+
+@pytest.mark.parametrize("template", [
+    "no fields at all",
+    "workdir/cod{acause}_{sex_id}.csv",
+    "{acause}{missing}{sex_id}",
+    "{missing:>3}",
+    "{missing!r}",
+    "{empty}",
+    "{acause!r}",
+    "{sex_id:03d}",
+    "{acause:>{width}}",
+    "{nested[key]}",
+    "{{escaped}}",
+])
+def test_compiled_matches_formatter(template):
+    expected = FormatterMissing().vformat(template, [], MAPPING)
+    assert _vformat(template, [], MAPPING) == expected
+
+
+def test_compile_is_cached():
+    template = "{acause}_{sex_id}"
+    assert compile_template(template) is compile_template(template)
+
+
+def test_missing_keys_stay_in_text():
+    assert _vformat("{hi}{there}{bob}", [], {"hi": "how", "there": "is"}) \
+        == "howis{bob}"
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import provda.digest
+import provda.logprov
+import provda.model
+from test_document import namespaces
+
+
+def test_hash_file_mmap(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("big.bin"))
+    contents = os.urandom(3000)
+    with open(filename, "wb") as stream:
+        stream.write(contents)
+    expected = hashlib.sha256(contents).hexdigest()
+    assert provda.digest.hash_file(filename) == expected
+    monkeypatch.setattr(provda.digest, "_CHUNK", 1024)
+    monkeypatch.setattr(provda.digest, "_MMAP_SIZE", 1024)
+    assert provda.digest.hash_file(filename) == expected
+
+
+def test_cache_hashes_each_version_once(tmpdir, monkeypatch):
+    calls = list()
+    hash_file = provda.digest.hash_file
+
+    def counting(path, size=None):
+        calls.append(path)
+        return hash_file(path, size)
+
+    monkeypatch.setattr(provda.digest, "hash_file", counting)
+    cache = provda.digest.HashCache(str(tmpdir.join("cache")))
+    filename = tmpdir.join("in.csv")
+    filename.write("a,b\n")
+    first = cache.digest(str(filename))
+    assert cache.digest(str(filename)) == first
+    # Another process finds it on disk.
+    other = provda.digest.HashCache(str(tmpdir.join("cache")))
+    assert other.digest(str(filename)) == first
+    assert len(calls) == 1
+
+    filename.write("a,b,c\n")
+    assert cache.digest(str(filename)) != first
+    assert len(calls) == 2
+
+
+def test_document_digests(tmpdir):
+    cache = provda.digest.HashCache()
+    m = provda.model.ProcessDocument(
+        namespaces, digests=provda.digest.Digester(cache=cache))
+    l = provda.logprov.ProvLogger("provda.tests.digests")
+    l.addHandler(m)
+    read = tmpdir.join("in.csv")
+    read.write("a,b\n")
+    written = tmpdir.join("out.csv")
+    l.read_file(str(read), "input")
+    l.write_file(str(written), "output")
+    l.write_file(str(tmpdir.join("never.csv")), "output")
+    written.write("c,d\n")
+    text = m.json()
+    assert hashlib.sha256(b"a,b\n").hexdigest() in text
+    assert hashlib.sha256(b"c,d\n").hexdigest() in text
+    assert text.count("unk:sha256") == 2
@@ -1,3 +1,6 @@
+import gc
+import time
+import weakref
 from argparse import Namespace
 import provda.model
 import provda.logprov
@@ -28,3 +31,42 @@ def test_with_logger():
     l.addHandler(m)
     l.write_file("/ihme/forecasting/all.hdf", "scalarrole")
     print(m)
+
+
+def test_batched_document():
+    m = provda.model.BatchedProcessDocument(namespaces, batch_size=10,
+                                            interval=0.05)
+    l = provda.logprov.ProvLogger("provda.tests.batched")
+    l.addHandler(m)
+    for idx in range(25):
+        l.read_file("/ihme/forecasting/in{}.hdf".format(idx), "input")
+    # The background thread adds them without a flush.
+    end = time.time() + 5
+    while len(m._relations) < 25 and time.time() < end:
+        time.sleep(0.01)
+    assert len(m._relations) == 25
+    assert not m._pending
+    assert "in24.hdf" in str(m)
+    m.close()
+
+
+def test_closed_batched_document_is_freed():
+    m = provda.model.BatchedProcessDocument(namespaces, interval=0.05)
+    m.close()
+    reference = weakref.ref(m)
+    del m
+    gc.collect()
+    assert reference() is None
+
+
+def test_repeated_reads_make_one_relation():
+    m = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("provda.tests.dedupe")
+    l.addHandler(m)
+    for idx in range(100):
+        l.read_file("/ihme/forecasting/same.hdf", "input")
+    l.write_file("/ihme/forecasting/same.hdf", "output")
+    provn = str(m)
+    assert provn.count("used(") == 2  # the script and the file
+    assert provn.count("wasGeneratedBy(") == 1
+    assert "unk:access_count=100" in provn
@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+import provda.handler
+import provda.model
+
+
+namespaces = {
+    "is": "https://healtdata.org/instances",
+    "people": "https://healthdata.org/people",
+    "code": "https://healthdata.org/code",
+    "doc": "https://healthdata.org/document"
+}
+
+
+class LinesHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        for line in self.rfile:
+            self.server.lines.append(json.loads(line.decode("utf-8")))
+
+
+class LinesServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ("localhost", 0), LinesHandler)
+        self.connections = 0
+        self.lines = list()
+
+    def wait_for(self, count, timeout=5):
+        """
+        Waits for the server to accept and read lines sent to it.
+        """
+        end = time.time() + timeout
+        while len(self.lines) < count and time.time() < end:
+            time.sleep(0.01)
+
+
+def test_sender_reuses_connection():
+    server = LinesServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        host, port = server.server_address
+        sender = provda.handler.TCPSender(host, port, batch_bytes=100)
+        model = provda.model.ProcessDocument(namespaces)
+        sent = sender.send(model)
+        sent += sender.send(model.json())
+        sender.close()
+        server.wait_for(sent)
+        server.shutdown()
+    finally:
+        server.server_close()
+    assert server.connections == 1
+    assert len(server.lines) == sent
+    assert all("document" in line for line in server.lines)
@@ -0,0 +1,23 @@
+import h5py
+import provda.hdf
+
+
+def test_add_keys_twice(tmpdir):
+    filename = str(tmpdir.join("out.hdf"))
+    provda.hdf.add_keys(filename, {"script": "run.py"})
+    provda.hdf.add_keys(filename, {"user": "someone"})
+    with h5py.File(filename, "r") as f:
+        assert f["/created"].attrs["script"] == "run.py"
+        assert f["/created"].attrs["user"] == "someone"
+
+
+def test_add_keys_many(tmpdir):
+    filenames = [str(tmpdir.join("out{}.hdf".format(i))) for i in range(4)]
+    filenames.append(str(tmpdir.join("missing").join("out.hdf")))
+    results = provda.hdf.add_keys_many(filenames, {"draws": 1000},
+                                       processes=2)
+    assert [r[0] for r in results] == filenames
+    assert all(error is None for (_, _, error) in results[:4])
+    assert results[4][2] is not None
+    with h5py.File(filenames[2], "r") as f:
+        assert f["/created"].attrs["draws"] == "1000"
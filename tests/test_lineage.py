@@ -0,0 +1,45 @@
+import provda.lineage
+import provda.logprov
+import provda.model
+from test_document import namespaces
+
+
+def run_document(reads, writes):
+    m = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("provda.tests.lineage")
+    l.addHandler(m)
+    for path in reads:
+        l.read_file(path, "input")
+        l.read_file(path, "input")
+    for path in writes:
+        l.write_file(path, "output")
+    return m
+
+
+def test_writers_and_readers(tmpdir, monkeypatch):
+    monkeypatch.setenv("SGE_JOB_ID", "4321")
+    store = provda.lineage.LineageStore(str(tmpdir.join("lineage.db")))
+    first = run_document(["/in/a.csv"], ["/out/b.hdf"])
+    second = run_document(["/out/b.hdf"], ["/out/c.hdf"])
+    assert store.ingest([first, second.json()]) > 4
+    writer = store.writers("/out/b.hdf")
+    assert [row["id"] for row in writer] == [first._process_id]
+    assert writer[0]["sge_job_id"] == "4321"
+    reader = store.readers("doc:/out/b.hdf")
+    assert [row["id"] for row in reader] == [second._process_id]
+    assert reader[0]["count"] == 2
+    assert [row["entity"] for row in store.outputs(second._process_id)] == \
+        ["doc:/out/c.hdf"]
+    assert "doc:/in/a.csv" in [
+        row["entity"] for row in store.inputs(first._process_id)]
+    assert len(store.activities(sge_job_id=4321)) == 2
+    store.close()
+
+
+def test_ingest_twice_replaces(tmpdir):
+    store = provda.lineage.LineageStore(str(tmpdir.join("lineage.db")))
+    document = run_document(["/in/a.csv"], ["/out/b.hdf"]).as_dict()
+    store.ingest([document])
+    store.ingest([document])
+    assert len(store.writers("/out/b.hdf")) == 1
+    assert len(store.activities()) == 1
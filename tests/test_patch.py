@@ -2,6 +2,7 @@ from io import StringIO
 import logging
 import numpy as np
 import provda.logprov
+import provda.model
 import provda.patch
 
 
@@ -30,3 +31,115 @@ def test_open():
         provda.patch.open("z.np", mode="w")
     except FileNotFoundError:
         pass
+
+
+def test_wraps_later_imports(tmpdir, monkeypatch):
+    tmpdir.join("provda_late_io.py").write(
+        "def save(path):\n    return path\n\n"
+        "class Table(object):\n    def to_csv(self, path):\n"
+        "        return path\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setitem(provda.patch.WRAPS0, "provda_late_io",
+                        {"in": [], "out": ["save", "Table.to_csv"]})
+    import provda_late_io
+    assert provda_late_io._provda_patch
+    assert hasattr(provda_late_io.save, "__wrapped__")
+    assert hasattr(provda_late_io.Table.to_csv, "__wrapped__")
+    assert provda_late_io.Table().to_csv("out.csv") == "out.csv"
+
+
+def test_register(tmpdir, monkeypatch):
+    tmpdir.join("provda_registered_io.py").write(
+        "def write_table(table, where):\n    return where\n\n"
+        "def copy(src, dst):\n    return dst\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setitem(provda.patch.WRAPS0, "provda_registered_io", {})
+    import provda_registered_io
+    provda.patch.register("provda_registered_io",
+                          writes=[("write_table", 1, "where")],
+                          copies=["copy"])
+    s = StringIO()
+    handler = logging.StreamHandler(s)
+    logging.root.addHandler(handler)
+    try:
+        provda_registered_io.write_table(None, where="out.parquet")
+        assert "ProvWrite" in s.getvalue()
+        provda_registered_io.copy("a.csv", "b.csv")
+        assert "ProvRead" in s.getvalue()
+    finally:
+        logging.root.removeHandler(handler)
+
+
+def _io_attributes(document, kind):
+    relations = document.as_dict()[kind].values()
+    return [r for r in relations if "unk:io_seconds" in r]
+
+
+def test_open_counts_bytes(tmpdir):
+    from test_document import namespaces
+    m = provda.model.ProcessDocument(namespaces)
+    patch_logger = logging.getLogger("provda.patch")
+    patch_logger.addHandler(m)
+    try:
+        filename = str(tmpdir.join("counted.txt"))
+        with provda.patch.open(filename, "w", encoding="utf-8") as out:
+            out.write(u"\u00e9" * 5)
+        with provda.patch.open(filename, encoding="utf-8") as source:
+            assert source.readline() == u"\u00e9" * 5
+            assert source.read() == ""
+        binary = str(tmpdir.join("counted.bin"))
+        with provda.patch.open(binary, "wb") as out:
+            out.write(b"0123456789")
+    finally:
+        patch_logger.removeHandler(m)
+    written = _io_attributes(m, "wasGeneratedBy")
+    read, = _io_attributes(m, "used")
+    # Five characters of text are ten bytes of utf-8.
+    for relation in written + [read]:
+        assert relation["unk:io_bytes"]["$"] == "10"
+        assert "unk:io_bytes_per_second" in relation
+
+
+def test_keyword_paths_are_reported(tmpdir, monkeypatch):
+    tmpdir.join("provda_keyword_io.py").write(
+        "def read_parquet(path, columns=None):\n    return path\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setitem(provda.patch.WRAPS0, "provda_keyword_io",
+                        {"in": [("read_parquet", 0, "path")]})
+    import provda_keyword_io
+    s = StringIO()
+    handler = logging.StreamHandler(s)
+    logging.root.addHandler(handler)
+    try:
+        provda_keyword_io.read_parquet(path="in.parquet")
+        assert "ProvRead" in s.getvalue()
+    finally:
+        logging.root.removeHandler(handler)
+
+
+def test_wrapper_times_calls(tmpdir):
+    from test_document import namespaces
+    filename = str(tmpdir.join("saved.bin"))
+
+    def save(path):
+        with open(path, "wb") as out:
+            out.write(b"x" * 100)
+
+    def load(path):
+        with open(path, "rb") as source:
+            return source.read()
+
+    m = provda.model.ProcessDocument(namespaces)
+    patch_logger = logging.getLogger("provda.patch")
+    patch_logger.addHandler(m)
+    try:
+        provda.patch.report_write(save)(filename)
+        for _ in range(3):
+            provda.patch.report_read(load)(filename)
+    finally:
+        patch_logger.removeHandler(m)
+    written, = _io_attributes(m, "wasGeneratedBy")
+    assert written["unk:io_bytes"]["$"] == "100"
+    read, = _io_attributes(m, "used")
+    assert read["unk:io_bytes"]["$"] == "300"
+    assert read["unk:access_count"]["$"] == "3"
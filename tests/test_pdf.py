@@ -0,0 +1,167 @@
+import pytest
+import provda.pdf
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+
+needs_reader = pytest.mark.skipif(PdfReader is None,
+                                  reason="PyPDF2 before 1.28")
+
+
+def write_pdf(filename, info=None, entry_end=b" \n", trailer_extra=""):
+    """
+    Writes a one-page PDF with a classic cross-reference table.
+
+    :param entry_end: The end of each cross-reference entry, which
+                      is two bytes in a well-formed table.
+    :param trailer_extra: More entries for the trailer dictionary.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>",
+    ]
+    if info is not None:
+        objects.append(info)
+    out = [b"%PDF-1.4\n"]
+    offsets = list()
+    for number, body in enumerate(objects, start=1):
+        offsets.append(sum(len(part) for part in out))
+        out.append("{} 0 obj\n".format(number).encode("ascii") + body +
+                   b"\nendobj\n")
+    xref = sum(len(part) for part in out)
+    out.append("xref\n0 {}\n0000000000 65535 f".format(
+        len(objects) + 1).encode("ascii") + entry_end)
+    for offset in offsets:
+        out.append("{:010d} 00000 n".format(offset).encode("ascii") +
+                   entry_end)
+    trailer = "trailer\n<< /Size {} /Root 1 0 R".format(len(objects) + 1)
+    if info is not None:
+        trailer += " /Info 4 0 R"
+    trailer += trailer_extra
+    out.append("{} >>\nstartxref\n{}\n%%EOF\n".format(
+        trailer, xref).encode("ascii"))
+    with open(filename, "wb") as stream:
+        stream.write(b"".join(out))
+
+
+def read_info(filename):
+    with open(filename, "rb") as stream:
+        stream.seek(0, 2)
+        end = stream.tell()
+        stream.seek(max(0, end - 2048))
+        tail = stream.read()
+        prev = int(tail[tail.rfind(b"startxref") + 9:].split()[0])
+        trailer = provda.pdf._read_trailer(stream, prev)
+        number = int(provda.pdf._REFERENCE.search(
+            trailer.split(b"/Info", 1)[1]).group(1))
+        offset = provda.pdf._find_object(stream, prev, number)
+        return provda.pdf._info_entries(stream, offset)
+
+
+def test_incremental_keeps_old_info(tmpdir):
+    filename = str(tmpdir.join("figure.pdf"))
+    write_pdf(filename, b"<< /Title (A (nested) title) /Author <FEFF0041> >>")
+    before = open(filename, "rb").read()
+    provda.pdf.add_keys(filename, {"script": "run.py", "Title": "new"})
+    after = open(filename, "rb").read()
+    assert after.startswith(before)
+    assert len(after) - len(before) < 512
+    info = read_info(filename)
+    assert info[b"/script"] == b"(run.py)"
+    assert info[b"/Title"] == b"(new)"
+    assert info[b"/Author"] == b"<FEFF0041>"
+
+
+def test_incremental_twice(tmpdir):
+    filename = str(tmpdir.join("figure.pdf"))
+    write_pdf(filename)
+    provda.pdf.add_keys(filename, {"script": "run.py"})
+    provda.pdf.add_keys(filename, {"user": "some one"})
+    info = read_info(filename)
+    assert info[b"/script"] == b"(run.py)"
+    assert info[b"/user"] == b"(some one)"
+
+
+def test_add_keys_many(tmpdir):
+    filenames = [str(tmpdir.join("f{}.pdf".format(i))) for i in range(3)]
+    for filename in filenames:
+        write_pdf(filename)
+    results = provda.pdf.add_keys_many(filenames, {"draws": 1000},
+                                       processes=2)
+    assert all(error is None for (_, _, error) in results)
+    assert read_info(filenames[1])[b"/draws"] == b"(1000)"
+
+
+def pypdf_info(filename):
+    with open(filename, "rb") as stream:
+        reader = PdfReader(stream)
+        assert len(reader.pages) == 1
+        return dict(reader.metadata)
+
+
+@needs_reader
+def test_incremental_reads_with_pypdf(tmpdir):
+    filename = str(tmpdir.join("figure.pdf"))
+    write_pdf(filename, b"<< /Title (Old) >>")
+    provda.pdf.add_keys(filename, {"script": "run.py"})
+    provda.pdf.add_keys(filename, {"user": "some one"})
+    info = pypdf_info(filename)
+    assert info["/Title"] == "Old"
+    assert info["/script"] == "run.py"
+    assert info["/user"] == "some one"
+
+
+@needs_reader
+def test_rewrite(tmpdir):
+    filename = str(tmpdir.join("figure.pdf"))
+    write_pdf(filename, b"<< /Title (Old) >>")
+    provda.pdf.add_keys(filename, {"script": "run.py"}, incremental=False)
+    info = pypdf_info(filename)
+    assert info["/Title"] == "Old"
+    assert info["/script"] == "run.py"
+
+
+@needs_reader
+def test_garbled_xref_falls_back(tmpdir):
+    filename = str(tmpdir.join("figure.pdf"))
+    write_pdf(filename, b"<< /Title (Old) >>", entry_end=b"\n")
+    with pytest.raises(provda.pdf.NotIncremental):
+        provda.pdf._append_info(filename, {"script": "run.py"})
+    provda.pdf.add_keys(filename, {"script": "run.py"})
+    assert pypdf_info(filename)["/script"] == "run.py"
+
+
+def test_hybrid_xref_is_not_incremental(tmpdir):
+    filename = str(tmpdir.join("hybrid.pdf"))
+    write_pdf(filename, b"<< /Title (Old) >>", trailer_extra=" /XRefStm 9")
+    with pytest.raises(provda.pdf.NotIncremental):
+        provda.pdf._append_info(filename, {"script": "run.py"})
+
+
+def test_missing_info_is_not_incremental(tmpdir):
+    filename = str(tmpdir.join("lost.pdf"))
+    write_pdf(filename, trailer_extra=" /Info 7 0 R")
+    with pytest.raises(provda.pdf.NotIncremental):
+        provda.pdf._append_info(filename, {"script": "run.py"})
+
+
+@needs_reader
+def test_encrypted_is_left_alone(tmpdir):
+    plain = str(tmpdir.join("plain.pdf"))
+    write_pdf(plain)
+    writer = PdfWriter()
+    writer.add_page(PdfReader(plain).pages[0])
+    writer.encrypt("", "owner")
+    filename = str(tmpdir.join("encrypted.pdf"))
+    with open(filename, "wb") as stream:
+        writer.write(stream)
+    with open(filename, "rb") as stream:
+        before = stream.read()
+    with pytest.raises(ValueError):
+        provda.pdf.add_keys(filename, {"script": "run.py"})
+    with open(filename, "rb") as stream:
+        assert stream.read() == before
+    assert PdfReader(filename).is_encrypted
@@ -1,6 +1,7 @@
 import logging
 from io import StringIO
 import sys
+import pytest
 import provda
 import provda.logprov
 
@@ -44,3 +45,29 @@ def test_other_calls():
     logger.read_table("sql:///forecasting-db", "gbd", "epi_v80", "results")
     logger.start_tasks("fbd.risk_factors.run_scalars",
                        ["235.1", "235.2", "235.3"])
+
+
+class DirectHandler(object):
+    level = logging.NOTSET
+
+    def __init__(self):
+        self.prov = list()
+
+    def handle_prov(self, prov, created):
+        self.prov.append(prov)
+
+    def handle(self, record):
+        raise AssertionError("Should not have made a LogRecord")
+
+
+def test_direct_provenance():
+    logger = provda.logprov.ProvLogger("provda.test.direct")
+    logger.propagate = False
+    handler = DirectHandler()
+    logger.addHandler(handler)
+    logger.read_file("/ihme/forecasting/blah.csv", "in_gbd")
+    assert handler.prov[0]["kind"] == "read_file"
+    # Any other handler that would see it means a LogRecord.
+    logger.addHandler(logging.NullHandler())
+    with pytest.raises(AssertionError):
+        logger.write_file("/ihme/forecasting/blah.csv", "out")
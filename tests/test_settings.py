@@ -1,3 +1,5 @@
+import argparse
+import os
 import pytest
 import provda
 
@@ -36,3 +38,146 @@ def test_two_sub(exampleimp):
     assert "filetypes" in minipackage.down.param
     assert "demog" in minipackage.down.param
     assert "demog" in minipackage.sub.examplemod.param
+
+
+def test_update_invalidates_cache():
+    param = provda.get_parameters("provda.tests.cached", {
+        "draws": provda.int(100),
+        "acause": "cvd_ihd",
+        "out": provda.path_template("results_{acause}_{draws}.hdf", "w")
+    })
+    assert param["draws"] == 100
+    assert str(param["out"]) == "results_cvd_ihd_100.hdf"
+    param.update({"draws": 200})
+    assert param["draws"] == 200
+    assert str(param["out"]) == "results_cvd_ihd_200.hdf"
+
+
+def test_parent_update_reaches_child():
+    parent = provda.get_parameters("provda.tests.cachedparent",
+                                   {"draws": provda.int(10)})
+    child = provda.get_parameters("provda.tests.cachedparent.child", {})
+    assert child["draws"] == 10
+    parent.update({"draws": 20})
+    assert child["draws"] == 20
+
+
+def test_cached_lists_are_copied():
+    param = provda.get_parameters("provda.tests.cachedlist",
+                                  {"stuff": ["one", "two"]})
+    param["stuff"].remove("one")
+    assert param["stuff"] == ["one", "two"]
+
+
+def test_freeze_and_install(tmpdir):
+    param = provda.get_parameters("provda.tests.frozen", {
+        "draws": provda.int(100),
+        "acause": "cvd_ihd",
+        "out": provda.path_template("results_{acause}.hdf", "w")
+    })
+    child = provda.get_parameters("provda.tests.frozen.child", {})
+    frozen = provda.parameters.freeze()
+    assert frozen["provda.tests.frozen.child"]["draws"] == 100
+    assert str(frozen["provda.tests.frozen"]["out"]) == "results_cvd_ihd.hdf"
+
+    filename = str(tmpdir.join("frozen.pkl"))
+    frozen.save(filename)
+    loaded = provda.parameters.load_frozen(filename)
+    param.update({"draws": 7})
+    provda.install_parameters(loaded)
+    try:
+        assert child["draws"] == 100
+        assert str(param["out"]) == "results_cvd_ihd.hdf"
+    finally:
+        provda.install_parameters(None)
+    assert child["draws"] == 7
+
+
+def test_add_arguments_types():
+    provda.get_parameters("provda.tests.cli", {
+        "cli_draws": provda.int(100),
+        "cli_scale": provda.double(0.5),
+        "cli_label": "mean",
+        "cli_ages": [1, 2, 3],
+        "cli_out": provda.path_template("out_{cli_label}.hdf", "w")
+    })
+    parser = argparse.ArgumentParser()
+    provda.parameters.add_arguments(parser)
+    args = parser.parse_args(["--provda.tests.cli.cli_draws", "7",
+                              "--cli_scale", "2", "--cli_out", "x.hdf"])
+    assert getattr(args, "provda.tests.cli.cli_draws") == 7
+    assert args.cli_scale == 2.0
+    assert args.cli_out == "x.hdf"
+    assert args.cli_label is None
+    assert not hasattr(args, "cli_ages")
+
+
+def test_add_arguments_only_named():
+    provda.get_parameters("provda.tests.lazy", {
+        "lazy_draws": provda.int(100),
+        "lazy_location": "Kenya"
+    })
+    parser = argparse.ArgumentParser()
+    argv = ["--lazy_dr=5"]
+    provda.parameters.add_arguments(parser, argv)
+    args = parser.parse_args(argv)
+    assert args.lazy_draws == 5
+    assert not hasattr(args, "lazy_location")
+
+    parser = argparse.ArgumentParser()
+    provda.parameters.add_arguments(parser, ["--lazy_draws", "5", "-h"])
+    assert "--lazy_location" in parser.format_help()
+
+
+def test_unqualified_flag_sets_every_definition():
+    first = provda.get_parameters("provda.tests.flag_a", {
+        "flag_draws": provda.int(10)})
+    second = provda.get_parameters("provda.tests.flag_b", {
+        "flag_draws": provda.int(20), "flag_other": provda.int(1)})
+    assert first in provda.parameters.Parameters.manager.defined_by[
+        "flag_draws"]
+    provda.parameters.namespace_settings(
+        argparse.Namespace(flag_draws=30, flag_missing=4))
+    assert first["flag_draws"] == 30
+    assert second["flag_draws"] == 30
+    assert second["flag_other"] == 1
+
+
+def test_load_settings_cached(tmpdir, monkeypatch):
+    monkeypatch.setenv("PROVDA_CACHE", str(tmpdir.join("cache")))
+    parsed = list()
+    parse = provda.parameters._parse_settings
+
+    def counting(filename, text):
+        parsed.append(filename)
+        return parse(filename, text)
+
+    monkeypatch.setattr(provda.parameters, "_parse_settings", counting)
+    settings = tmpdir.join("run.yaml")
+    settings.write("provda.tests.yaml_load:\n  draws: 100\n")
+    expected = {"provda.tests.yaml_load": {"draws": 100}}
+    assert provda.parameters.load_settings(str(settings)) == expected
+    assert provda.parameters.load_settings(str(settings)) == expected
+    assert len(parsed) == 1
+
+    # Touched, but the same bytes.
+    stat = os.stat(str(settings))
+    os.utime(str(settings), (stat.st_atime, stat.st_mtime + 10))
+    assert provda.parameters.load_settings(str(settings)) == expected
+    assert len(parsed) == 1
+
+    settings.write("provda.tests.yaml_load:\n  draws: 200\n")
+    assert provda.parameters.load_settings(str(settings)) == \
+        {"provda.tests.yaml_load": {"draws": 200}}
+    assert len(parsed) == 2
+
+
+def test_read_settings_file(tmpdir, monkeypatch):
+    monkeypatch.setenv("PROVDA_CACHE", str(tmpdir.join("cache")))
+    param = provda.get_parameters("provda.tests.read_file", {
+        "draws": provda.int(100)})
+    settings = tmpdir.join("run.settings")
+    settings.write('{"provda.tests.read_file": {"draws": 7}}')
+    provda.parameters.namespace_settings(
+        argparse.Namespace(settings=[str(settings)]))
+    assert param["draws"] == 7
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import provda
+import provda.sidecar
+
+
+def test_by_path_and_hash(tmpdir):
+    store = provda.sidecar.SidecarStore(str(tmpdir.join("store")))
+    output = tmpdir.join("out.csv")
+    output.write("a,b\n1,2\n")
+    sha256 = store.put(str(output), {"unk:script": "run.py"})
+    assert sha256 == hashlib.sha256(b"a,b\n1,2\n").hexdigest()
+
+    record = store.by_path(str(output))
+    assert record["path"] == os.path.realpath(str(output))
+    assert record["provenance"] == {"unk:script": "run.py"}
+    assert store.by_hash(sha256)["provenance"] == {"unk:script": "run.py"}
+    assert store.by_hash("0" * 64) is None
+    assert store.by_path(str(tmpdir.join("other.csv"))) is None
+
+
+def test_changed_file(tmpdir):
+    store = provda.sidecar.SidecarStore(str(tmpdir.join("store")))
+    output = tmpdir.join("out.csv")
+    output.write("a,b\n")
+    store.put(str(output), {"draws": 10})
+    output.write("a,b,c\n")
+    assert store.by_path(str(output)) is None
+    assert store.by_path(str(output), check=False)["provenance"] == \
+        {"draws": 10}
+    store.remove(str(output))
+    assert store.by_path(str(output), check=False) is None
+
+
+def test_add_provenance(tmpdir, monkeypatch):
+    monkeypatch.setenv("PROVDA_SIDECAR", str(tmpdir.join("store")))
+    output = tmpdir.join("figure.png")
+    output.write_binary(b"\x89PNG")
+    provda.add_provenance(str(output), {"location": "Kenya"})
+    store = provda.sidecar.SidecarStore(str(tmpdir.join("store")))
+    provenance = store.by_path(str(output))["provenance"]
+    assert provenance["location"] == "Kenya"
+    assert provenance["unk:process_id"] == os.getpid()
+    assert "unk:script" in provenance
+
+
+def test_same_contents(tmpdir):
+    store = provda.sidecar.SidecarStore(str(tmpdir.join("store")))
+    first = tmpdir.join("a.csv")
+    second = tmpdir.join("b.csv")
+    first.write("a,b\n1,2\n")
+    second.write("a,b\n1,2\n")
+    sha256 = store.put(str(first), {"job": "A"})
+    assert store.put(str(second), {"job": "B"}) == sha256
+    assert store.by_path(str(first))["provenance"] == {"job": "A"}
+    assert store.by_path(str(second))["provenance"] == {"job": "B"}
+    jobs = [r["provenance"]["job"] for r in store.records_by_hash(sha256)]
+    assert sorted(jobs) == ["A", "B"]
+    store.remove(str(second))
+    assert store.by_hash(sha256)["provenance"] == {"job": "A"}
@@ -0,0 +1,114 @@
+import os
+import threading
+import provda.handler
+import provda.model
+import provda.spool
+from test_handler import LinesServer, namespaces
+
+
+def test_spool_then_drain(tmpdir):
+    spool = str(tmpdir.join("spool"))
+    model = provda.model.ProcessDocument(namespaces)
+    path = provda.spool.spool_document(model, spool)
+    assert os.path.exists(path)
+    assert provda.spool.ready_files(spool) == [path]
+
+    server = LinesServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        host, port = server.server_address
+        sender = provda.handler.TCPSender(host, port)
+        assert provda.spool.drain(spool, sender) == 1
+        sender.close()
+        server.wait_for(1)
+        server.shutdown()
+    finally:
+        server.server_close()
+    assert not os.path.exists(path)
+    assert len(server.lines) > 0
+
+
+def test_drain_keeps_files_when_down(tmpdir):
+    spool = str(tmpdir.join("spool"))
+    path = provda.spool.spool_document(
+        provda.model.ProcessDocument(namespaces), spool)
+    sender = provda.handler.TCPSender("localhost", 1, retries=0)
+    assert provda.spool.drain(spool, sender) == 0
+    assert os.path.exists(path)
+
+
+def test_open_files_wait(tmpdir):
+    spool = str(tmpdir.join("spool"))
+    writer = provda.spool.SpoolWriter(spool)
+    writer.append_document(provda.model.ProcessDocument(namespaces))
+    assert provda.spool.ready_files(spool) == []
+    writer.close()
+    assert provda.spool.ready_files(spool) == [writer.path]
+
+
+def test_handler_writes_ahead(tmpdir):
+    import json
+    import provda.logprov
+    spool = str(tmpdir.join("spool"))
+    model = provda.model.ProcessDocument(namespaces)
+    handler = provda.spool.SpoolHandler(spool, model)
+    l = provda.logprov.ProvLogger("provda.tests.spool")
+    l.addHandler(model)
+    l.addHandler(handler)
+    l.read_file("/ihme/forecasting/in.hdf", "input")
+    # On disk before the process closes anything, as for a killed job.
+    open_file, = tmpdir.join("spool").listdir()
+    record = json.loads(open_file.read_binary().decode("utf-8"))
+    assert record["@fields"]["path"] == "/ihme/forecasting/in.hdf"
+    assert record["document"] == model._process_id
+    l.read_file("/ihme/forecasting/once.hdf", "input")
+    l.read_file("/ihme/forecasting/in.hdf", "input")
+    handler.close(model)
+    assert provda.spool.ready_files(spool) == [handler.writer.path]
+    with open(handler.writer.path, "rb") as stream:
+        lines = [json.loads(line.decode("utf-8")) for line in stream]
+    assert len([line for line in lines if line["prov"] == "read_file"]) == 3
+    # At exit, only the process and the read that was counted again.
+    usages = [line["@fields"] for line in lines if line["prov"] == "used"]
+    script = [usage for usage in usages if usage["prov:entity"] not in (
+        "doc:/ihme/forecasting/in.hdf", "doc:/ihme/forecasting/once.hdf")]
+    assert len(usages) == len(script) + 1
+    assert any("unk:access_count" in usage for usage in usages)
+    assert any(line["prov"] == "activity" for line in lines)
+
+
+def test_drain_drops_partial_line(tmpdir):
+    spool = tmpdir.mkdir("spool")
+    spool.join("host-1-abc.jsonl").write_binary(b'{"a": 1}\n{"b": ')
+    server = LinesServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        host, port = server.server_address
+        sender = provda.handler.TCPSender(host, port)
+        assert provda.spool.drain(str(spool), sender) == 1
+        sender.close()
+        server.wait_for(1)
+        server.shutdown()
+    finally:
+        server.server_close()
+    assert len(server.lines) == 1
+
+
+def test_ready_files_skips_removed(tmpdir, monkeypatch):
+    spool = tmpdir.mkdir("spool")
+    spool.join("host-1-a.jsonl").write("")
+    spool.join("host-1-b.jsonl").write("")
+    getmtime = os.path.getmtime
+
+    def removed(path):
+        if path.endswith("a.jsonl"):
+            raise OSError(2, "No such file")
+        return getmtime(path)
+
+    monkeypatch.setattr(os.path, "getmtime", removed)
+    assert provda.spool.ready_files(str(spool)) == [
+        str(spool.join("host-1-b.jsonl"))]
@@ -0,0 +1,50 @@
+import io
+import json
+import prov.model
+import provda.model
+import provda.streaming
+from test_binary import busy_document
+
+
+def test_json_matches():
+    m = busy_document()
+    stream = io.StringIO()
+    m.write_json(stream)
+    assert json.loads(stream.getvalue()) == json.loads(m.json())
+
+
+def test_provn_matches():
+    m = busy_document()
+    stream = io.StringIO()
+    m.write_provn(stream)
+    assert stream.getvalue() == str(m)
+
+
+def test_shared_identifiers_and_bundles():
+    document = prov.model.ProvDocument()
+    document.set_default_namespace("http://example.org/")
+    document.add_namespace("ex", "http://example.org/ex#")
+    document.entity("ex:a", {"ex:n": 1})
+    document.entity("ex:a", {"ex:n": 2})
+    document.activity("ex:run")
+    document.used("ex:run", "ex:a")
+    document.wasGeneratedBy("ex:a", "ex:run")
+    bundle = document.bundle("ex:bundle")
+    bundle.entity("ex:b")
+    stream = io.StringIO()
+    provda.streaming.write_json(document, stream)
+    assert json.loads(stream.getvalue()) == \
+        json.loads(document.serialize(format="json"))
+    stream = io.StringIO()
+    provda.streaming.write_provn(document, stream)
+    assert stream.getvalue() == document.get_provn()
+
+
+def test_to_file(tmpdir):
+    m = busy_document()
+    filename = str(tmpdir.join("provenance.json"))
+    with open(filename, "w") as stream:
+        m.write_json(stream)
+    with open(filename) as stream:
+        read = prov.model.ProvDocument.deserialize(stream, format="json")
+    assert read == m._document
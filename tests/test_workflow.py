@@ -0,0 +1,71 @@
+import io
+import json
+import prov.model
+import provda.logprov
+import provda.model
+import provda.workflow
+from test_document import namespaces
+
+
+def task_document(monkeypatch, job_id, output):
+    monkeypatch.setenv("SGE_JOB_ID", job_id)
+    m = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("provda.tests.workflow")
+    l.addHandler(m)
+    l.read_file("/shared/population.hdf", "input")
+    l.write_file(output, "output")
+    return m.as_dict()
+
+
+def test_merge_links_tasks(monkeypatch):
+    first = task_document(monkeypatch, "11", "/out/11.hdf")
+    monkeypatch.delenv("SGE_JOB_ID")
+    parent = provda.model.ProcessDocument(namespaces)
+    l = provda.logprov.ProvLogger("provda.tests.workflow_parent")
+    l.addHandler(parent)
+    l.start_tasks("calculate_pafs", ["11", "12"])
+    parent = parent.as_dict()
+    second = task_document(monkeypatch, "12", "/out/12.hdf")
+
+    out = io.StringIO()
+    merger = provda.workflow.merge_documents([first, parent, second], out)
+    assert merger.documents == 3
+    assert merger.linked == 2
+
+    merged = json.loads(out.getvalue())
+    started = {r["prov:trigger"]: r for r in merged["wasStartedBy"].values()}
+    assert started["doc:11"]["prov:activity"] in first["activity"]
+    assert started["doc:12"]["prov:starter"] in parent["activity"]
+    assert "doc:/shared/population.hdf" in merged["entity"]
+    assert len(merged["activity"]) == 3
+    assert len(merged["used"]) == len(first["used"]) + len(second["used"]) + \
+        len(parent.get("used", {}))
+    # The prov library can read it back.
+    prov.model.ProvDocument.deserialize(content=out.getvalue(), format="json")
+
+
+def test_parents_keep_their_collections(monkeypatch):
+    parents = list()
+    for name, tasks in [("first", ["21", "22"]), ("second", ["31"])]:
+        parent = provda.model.ProcessDocument(namespaces)
+        l = provda.logprov.ProvLogger("provda.tests.workflow_" + name)
+        l.addHandler(parent)
+        l.start_tasks("calculate_pafs", tasks)
+        parents.append(parent.as_dict())
+    out = io.StringIO()
+    provda.workflow.merge_documents(parents, out)
+    merged = json.loads(out.getvalue())
+    collections = [identifier for identifier in merged["entity"]
+                   if identifier.startswith("unk:processcollection")]
+    assert len(collections) == 2
+    members = dict()
+    for relation in merged["hadMember"].values():
+        members.setdefault(relation["prov:collection"], set()).add(
+            relation["prov:entity"])
+    assert sorted(members.values(), key=len) == [{"doc:31"},
+                                                 {"doc:21", "doc:22"}]
+    for relation in merged["wasInfluencedBy"].values():
+        collection = relation["prov:influencee"]
+        assert collection in collections
+        assert collection.endswith(relation["prov:influencer"].split(":")[1])
+    prov.model.ProvDocument.deserialize(content=out.getvalue(), format="json")